@@ -1,3 +1,6 @@
 from . import cnmfwrap
 from . import cnmf_process
-from .cnmf_process import CNMF_PROCESS, tocoord
+from . import cluster
+from . import scheduler
+from .cnmf_process import CNMF_PROCESS, tocoord, sparse_to_regions
+from .cluster import ClusterManager
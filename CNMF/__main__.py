@@ -39,6 +39,16 @@ def main():
         help = 'gSig value, expected half size of neurons, [Default: g=5]')
     parser.add_argument('-_merge', default = 0.8, type = float,
         help = 'merging threshold, max correlation allowed, [Default: merge=0.8]')
+    parser.add_argument('-cache',
+        help = 'folder of the movie cache shared by all modules; frames are decoded only once')
+    parser.add_argument('-n_processes', type = int,
+        help = 'number of workers in the cluster shared by all datasets, [Default: all cores]')
+    parser.add_argument('-jobs', '--jobs', default = 1, type = int,
+        help = 'number of datasets processed concurrently, [Default: jobs=1]')
+    parser.add_argument('-sidecar', action = 'store_true',
+        help = 'also write run-length encoded masks to prediction.npz for fast scoring')
+    parser.add_argument('-truth',
+        help = 'ground-truth regions (.json) to score the prediction against')
     parser.set_defaults(func = cnmfwrap.main)
     args = parser.parse_args()
 
@@ -0,0 +1,63 @@
+"""
+Keeps one CaImAn cluster alive across datasets.
+Starting the worker pool (and importing TensorFlow/Keras in every worker) costs
+more than CNMF itself on the small neurofinder sets, so the pool is started once
+and handed to every CNMF_PROCESS call:
+    with ClusterManager() as cluster:
+        for movie in movies:
+            CNMF_PROCESS(movie, _k, _g, _merge, dview=cluster.dview,
+                         n_processes=cluster.n_processes)
+An existing dview can be wrapped too, it is then left running on exit.
+"""
+
+import caiman as cm
+
+class ClusterManager(object):
+    """
+    Context manager around cm.cluster.setup_cluster / cm.stop_server.
+    """
+
+    def __init__(self, n_processes=None, dview=None, backend='local'):
+        self.n_processes = n_processes
+        self.dview = dview
+        self.backend = backend
+        self.owned = False
+
+    def start(self):
+        """
+        Start the worker pool, unless it is already running or was passed in.
+        """
+        if self.dview is None:
+            c, self.dview, self.n_processes =\
+                cm.cluster.setup_cluster(backend=self.backend, n_processes=self.n_processes,
+                                         single_thread=False)
+            self.owned = True
+        elif self.n_processes is None:
+            self.n_processes = _n_workers(self.dview)
+        return self
+
+    def stop(self):
+        """
+        Stop the worker pool if it was started here.
+        """
+        if self.owned:
+            cm.stop_server()
+            self.dview.terminate()
+            self.dview = None
+            self.owned = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+def _n_workers(dview):
+    """
+    helper function for ClusterManager; number of workers of a
+    multiprocessing pool or of an ipyparallel view.
+    """
+    if hasattr(dview, '_processes'):
+        return dview._processes
+    return len(dview)
@@ -6,6 +6,7 @@ Evaluates the selected components and Plots the neurons on the original plot.
 from __future__ import print_function
 from builtins import range
 import numpy as np
+import scipy.sparse as ss
 import glob
 import matplotlib.pyplot as plt
 import tifffile
@@ -13,31 +14,41 @@ import caiman as cm
 from caiman.components_evaluation import estimate_components_quality_auto
 from caiman.source_extraction.cnmf import cnmf as cnmf
 import os
+from .cluster import ClusterManager
 
-def CNMF_PROCESS(tif_movie, _k, _g, _merge):
+def CNMF_PROCESS(movie, _k, _g, _merge, dataset_name=None, dview=None, n_processes=None):
     """
-    Inputs .tif movie (transforming from time series images)
+    Inputs .tif movie (transforming from time series images),
+    or an F-ordered Yr .mmap file which is used as is
+    (from Common.save_memmap or the movie cache)
     Applys constrained nonnegative matrix factorization
+    on the given dview (e.g. from a ClusterManager shared across datasets),
+    or on a cluster started and stopped for this movie only
     Outputs selected neurons sparse matrix and dimension of movie
     """
 
-    dataset_name = tif_movie.replace('.tif','')
-
-    # start a cluster
-    c, dview, n_processes =\
-        cm.cluster.setup_cluster(backend='local', n_processes=None, single_thread=False)
-
-    # process movie file
-    fnames = [tif_movie]
-    # location of dataset  (can actually be a list of filed to be concatenated)
-    add_to_movie = -np.min(cm.load(fnames[0], subindices=range(200))).astype(float)
-    # determine minimum value on a small chunk of data
-    add_to_movie = np.maximum(add_to_movie, 0)
-    # if minimum is negative subtract to make the data non-negative
-    base_name = 'Yr'
-    name_new = cm.save_memmap_each(fnames, dview=dview, base_name=base_name, add_to_movie=add_to_movie)
-    name_new.sort()
-    fname_new = cm.save_memmap_join(name_new, base_name='Yr', dview=dview)
+    if dataset_name is None:
+        dataset_name = os.path.basename(movie).replace('.tif','')
+
+    # start a cluster, unless one is shared across datasets
+    cluster = ClusterManager(n_processes=n_processes, dview=dview).start()
+    dview, n_processes = cluster.dview, cluster.n_processes
+
+    if movie.endswith('.mmap'):
+        # already memory mapped in the layout CaImAn expects
+        fname_new = movie
+    else:
+        # process movie file
+        fnames = [movie]
+        # location of dataset  (can actually be a list of filed to be concatenated)
+        add_to_movie = -np.min(cm.load(fnames[0], subindices=range(200))).astype(float)
+        # determine minimum value on a small chunk of data
+        add_to_movie = np.maximum(add_to_movie, 0)
+        # if minimum is negative subtract to make the data non-negative
+        base_name = 'Yr' + dataset_name
+        name_new = cm.save_memmap_each(fnames, dview=dview, base_name=base_name, add_to_movie=add_to_movie)
+        name_new.sort()
+        fname_new = cm.save_memmap_join(name_new, base_name=base_name, dview=dview)
     ### LOAD MEMORY MAPPABLE FILE
     Yr, dims, T = cm.load_memmap(fname_new)
     d1, d2 = dims
@@ -124,15 +135,15 @@ def CNMF_PROCESS(tif_movie, _k, _g, _merge):
                                             dims[0], dims[1],
                                             YrA=cnm.YrA[idx_components, :], img=Cn)
 
-    ### STOP CLUSTER and clean up log files
-    cm.stop_server()
+    ### STOP CLUSTER (if started here) and clean up log files
+    cluster.stop()
 
-    log_files = glob.glob('Yr*_LOG_*')
+    # only the logs of this movie (named after its memmap), other jobs may still be running
+    log_files = glob.glob(os.path.splitext(fname_new)[0] + '*_LOG_*')
     for log_file in log_files:
         os.remove(log_file)
 
-    dview.terminate()
-    return cnm.A.tocsc()[:, idx_components]
+    return cnm.A.tocsc()[:, idx_components], dims
 
 def tocoord(pixels_array, dims):
     """
@@ -141,3 +152,19 @@ def tocoord(pixels_array, dims):
     """
     coordinates = np.argwhere(pixels_array.reshape(dims)!=0)
     return coordinates.tolist()
+
+def sparse_to_regions(pixels, dims):
+    """
+    Transforms the sparse matrix of selected neurons (pixels x neurons) into
+    the coordinates of each neuron, without ever densifying it.
+    Walks the CSC indptr/indices arrays in one pass over all neurons and unravels
+    the pixel indices in Fortran order, the way CaImAn flattens the FOV.
+    Returns the list of regions in the neurofinder format.
+    """
+    A = ss.csc_matrix(pixels)
+    nonzero = A.data != 0
+    # neuron of every stored entry, keeping only the entries that are non zero
+    neuron = np.repeat(np.arange(A.shape[1]), np.diff(A.indptr))[nonzero]
+    coordinates = np.column_stack(np.unravel_index(A.indices[nonzero], dims, order='F')).tolist()
+    bounds = np.searchsorted(neuron, np.arange(A.shape[1] + 1))
+    return [{"coordinates": coordinates[start:end]} for start, end in zip(bounds[:-1], bounds[1:])]
@@ -1,5 +1,6 @@
 """
-Generates .tif movie from .tiff images for each frame.
+Streams the .tiff images of each frame into a memory mapped movie,
+or takes the memory mapped movie from the shared movie cache.
 Runs CNMF extraction algorithm with CaImAn (https://github.com/flatironinstitute/CaImAn)
 Evaluates the selected components and Plots the neurons on the original plot.
 Generates neurons' coordinates as format.
@@ -8,47 +9,95 @@ Generates neurons' coordinates as format.
 import numpy as np
 from glob import glob
 import matplotlib.pyplot as plt
-import tifffile
 import os
-from .cnmf_process import CNMF_PROCESS, tocoord
+from .cnmf_process import CNMF_PROCESS, sparse_to_regions
+from .cluster import ClusterManager
+from .scheduler import schedule
+from Common import MovieCache, save_memmap, PredictionWriter, write_dataset
+from Common import score_submission, print_scores
 import scipy.sparse as ss
 from scipy.sparse import csr_matrix
 import json
+from collections import OrderedDict
 
 def main(setName = ['00.00', '00.01','01.00','01.01','02.00','02.01','03.00','04.00','04.01'],
-            _k = 1000, _g = 5, _merge = 0.8):
+            _k = 1000, _g = 5, _merge = 0.8, cache = None, n_processes = None, dview = None, jobs = 1,
+            sidecar = False, truth = None):
     """
     Main method for neuron segmentation using CNMF approach.
+    If cache names a folder, the movies are kept there as memmaps and shared with
+    the ThunderNMF and UNET entry points, so the frames are decoded only once.
+    The cluster of n_processes workers is started once and reused for all
+    datasets; pass dview to run on an already running cluster instead.
+    With jobs > 1, up to that many datasets run concurrently, each in its own
+    process and cluster, with cores and memory budgeted by movie size.
+    prediction.json is streamed to disk one dataset at a time; with sidecar, the
+    run-length encoded masks are also written to prediction.npz for the scorer.
+    If truth names a ground-truth file, the prediction is scored once written.
     """
-    prediction = []
     os.makedirs('figures/')
     os.makedirs('pixels_npz/')
     os.makedirs('predictions/')
-    for data in setName:
+    files = OrderedDict((data, sorted(glob('neurofinder.'+data+'.test/images/*.tiff')))
+                        for data in setName)
+    with PredictionWriter("prediction.json", sidecar="prediction.npz" if sidecar else None) as writer:
+        if jobs > 1:
+            print('***** Scheduling {} datasets on {} jobs ***********************'.format(len(setName), jobs))
+            schedule(files, jobs, process_dataset, _k=_k, _g=_g, _merge=_merge, cache=cache)
+            print('***** Saving predictions ******************************************')
+            for data in setName:
+                with open(_prediction_path(data + '.test')) as f:
+                    result = json.load(f)
+                writer.write(result["dataset"], result["regions"], result["dims"])
+        else:
+            print('***** Starting cluster ******************************************')
+            with ClusterManager(n_processes=n_processes, dview=dview) as cluster:
+                for data in setName:
+                    regions, dims = process_dataset(data, files[data], _k, _g, _merge, cache=cache,
+                                                    dview=cluster.dview, n_processes=cluster.n_processes)
+                    print('***** Saving predictions ******************************************')
+                    writer.write(data + '.test', regions, dims)
 
-        print('***** Generating .tif movie from .tiff images *****************')
-        files = sorted(glob('neurofinder.'+data+'.test/images/*.tiff'))
-        images = [tifffile.imread(f) for f in files]
-        name = data + '.test'
-        tifffile.imsave(name+'.tif', np.array(images))
+    if truth:
+        print('***** Scoring predictions *****************************************')
+        print_scores(score_submission(truth, "prediction.npz" if sidecar else "prediction.json"))
 
-        print('***** Constrained NMF *****************************************')
-        pixels, dims = CNMF_PROCESS(name+'.tif', _k, _g, _merge) #scipy sparse matrix
+    print('***** Mission Complete! *******************************************')
 
-        print('***** Saving selected neurons pixels location *****************')
-        ss.save_npz('pixels_npz/pixels_'+name+'.npz', pixels)
+def process_dataset(data, files, _k = 1000, _g = 5, _merge = 0.8, cache = None,
+                    dview = None, n_processes = None):
+    """
+    Runs CNMF on one dataset and saves its selected pixels and its prediction.
+    Starts its own cluster of n_processes workers unless dview is given.
+    Returns the regions and the dimension of the movie, which are also kept in
+    the saved prediction for the datasets run by the scheduler.
+    """
+    name = data + '.test'
+    if cache:
+        print('***** Loading memory mapped movie from cache ******************')
+        movie = MovieCache(cache).get(name, files).yr_path
+    else:
+        print('***** Streaming .tiff images into memory mapped movie *********')
+        movie, add_to_movie = save_memmap(files, base_name='Yr'+data)
 
-        print('***** Generates neurons coordinates ***************************')
-        neurons_pixels = np.array(pixels.todense()) # sparse > dense > numpy array
-        regions = [{"coordinates": tocoord(pix,dims)} for pix in list(neurons_pixels.T)]
-        result = {"dataset": name, "regions": regions}
+    print('***** Constrained NMF *****************************************')
+    pixels, dims = CNMF_PROCESS(movie, _k, _g, _merge, dataset_name=name, #scipy sparse matrix
+                                dview=dview, n_processes=n_processes)
 
-        print('***** Saving individual sparse matrix *************************')
-        json.dump(result, open("predictions/prediction_"+name+".json", "w"))
-        prediction.append(result)
-        os.remove(name+'.tif')
+    print('***** Saving selected neurons pixels location *****************')
+    ss.save_npz('pixels_npz/pixels_'+name+'.npz', pixels)
 
-    print('***** Saving predictions ******************************************')
-    json.dump(prediction, open("prediction.json", "w"))
+    print('***** Generates neurons coordinates ***************************')
+    regions = sparse_to_regions(pixels, dims) # straight from the sparse matrix
 
-    print('***** Mission Complete! *******************************************')
+    print('***** Saving individual sparse matrix *************************')
+    write_dataset(_prediction_path(name), name, regions, dims=dims)
+    if not cache:
+        os.remove(movie)
+    return regions, dims
+
+def _prediction_path(name):
+    """
+    Path of the prediction of a single dataset.
+    """
+    return "predictions/prediction_"+name+".json"
@@ -0,0 +1,86 @@
+"""
+Runs several CNMF datasets at the same time.
+Every dataset is processed in its own process with its own CaImAn cluster.
+Cores and memory are budgeted from the size of each movie (frames x FOV), so
+small sets like 00.01 are slotted in next to large ones like 02.00 instead of
+queueing behind them:
+    schedule(files, jobs, process_dataset, _k=1000, _g=5, _merge=0.8)
+"""
+
+from __future__ import division
+import multiprocessing as mp
+from multiprocessing.connection import wait
+import numpy as np
+import psutil
+from Common import frame_shape
+
+# CNMF holds a few copies of the float32 movie (Yr pages, the reshaped images,
+# the residuals used for component evaluation), so budget that many movies
+MEMORY_FACTOR = 3
+
+def schedule(files, jobs, target, n_cores=None, memory=None, **kwargs):
+    """
+    Run target(data, files[data], n_processes=n, **kwargs) for every dataset,
+    at most `jobs` at a time.
+    Largest datasets are started first. A dataset is started as soon as a job slot,
+    its cores and its memory are free; smaller datasets fill in the gaps left while
+    a large one waits. A dataset always starts when nothing else is running.
+    Input: an ordered dict of dataset name -> frame files, the number of
+    concurrent jobs, the function to run, the cores and bytes of memory to share
+    [Default: all cores, available memory] and the keyword arguments of target.
+    Output: None; raises RuntimeError listing the datasets that failed.
+    """
+    n_cores = n_cores or mp.cpu_count()
+    memory = memory or psutil.virtual_memory().available
+    budget = plan(files, jobs, n_cores)
+    pending = sorted(budget, key=lambda data: budget[data]['size'], reverse=True)
+    running = {}
+    failed = []
+    while pending or running:
+        cores = n_cores - sum(budget[data]['cores'] for data, proc in running.values())
+        free = memory - sum(budget[data]['memory'] for data, proc in running.values())
+        for data in list(pending):
+            if len(running) >= jobs:
+                break
+            need = budget[data]
+            if running and (need['cores'] > cores or need['memory'] > free):
+                continue
+            print('***** Starting {} on {} cores *****'.format(data, need['cores']))
+            proc = mp.Process(target=target, args=(data, files[data]),
+                              kwargs=dict(kwargs, n_processes=need['cores']))
+            proc.start()
+            running[proc.sentinel] = (data, proc)
+            pending.remove(data)
+            cores -= need['cores']
+            free -= need['memory']
+        for sentinel in wait(list(running)):
+            data, proc = running.pop(sentinel)
+            proc.join()
+            if proc.exitcode != 0:
+                failed.append(data)
+            print('***** Finished {} (exit code {}) *****'.format(data, proc.exitcode))
+    if failed:
+        raise RuntimeError('CNMF failed for datasets {}'.format(failed))
+
+def plan(files, jobs, n_cores):
+    """
+    Budget the cores and memory of every dataset from its movie size.
+    A dataset of average size gets n_cores / jobs cores; larger and smaller
+    ones get proportionally more or fewer, between 1 and n_cores.
+    Output: a dict of dataset name -> {'size', 'cores', 'memory'}.
+    Raises a ValueError if a dataset has no frames.
+    """
+    sizes = {}
+    for data, frames in files.items():
+        if len(frames) == 0:
+            raise ValueError('Dataset {} has no frames'.format(data))
+        d1, d2 = frame_shape(frames[0])
+        sizes[data] = len(frames) * d1 * d2
+    mean = np.mean(list(sizes.values()))
+    share = n_cores / min(jobs, len(files))
+    budget = {}
+    for data, size in sizes.items():
+        cores = int(np.clip(round(share * size / mean), 1, n_cores))
+        budget[data] = {'size': size, 'cores': cores,
+                        'memory': MEMORY_FACTOR * 4 * size}
+    return budget
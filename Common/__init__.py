@@ -0,0 +1,15 @@
+from .frames import list_frames, read_frames, iter_frames, frame_shape
+from .memmap import save_memmap
+from .moviecache import MovieCache, CachedMovie
+from .predictions import PredictionWriter, write_dataset, read_sidecar
+from .scoring import score, score_submission, print_scores
+from .summary import SummaryImages, summarize
+from . import frames
+from . import filters
+from . import memmap
+from . import moviecache
+from . import predictions
+from . import scoring
+from . import summary
+from . import synthetic
+from . import benchmark
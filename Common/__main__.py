@@ -0,0 +1,68 @@
+'''
+Main file for the tools shared by all modules. The structure is largely inspired from
+https://github.com/dsp-uga/elizabeth/blob/master/elizabeth/__main__.py
+Credits to @cbarrick and @zachdj
+'''
+
+import argparse
+from .scoring import score_submission, print_scores
+from . import benchmark
+
+def score(truth, prediction, threshold=5):
+    '''
+    Print the neurofinder scores of a prediction.
+    '''
+    print_scores(score_submission(truth, prediction, threshold=threshold))
+
+def run_benchmark(datasets=[], synthetic=[], seed=0, pipelines=list(benchmark.PIPELINES), n_workers=None,
+                  unet_model=None, workdir='benchmark', report='benchmark.json'):
+    '''
+    Benchmark the pipelines on the given and synthetic datasets.
+    '''
+    datasets = list(datasets) + [benchmark.synthetic(workdir, T, H, W, neurons, seed)
+                                 for T, H, W, neurons in synthetic]
+    if not datasets:
+        raise ValueError('Give --datasets and/or --synthetic')
+    options = {'ThunderNMF': {'n_workers': n_workers}, 'CNMF': {'n_processes': n_workers},
+               'UNET': {'model': unet_model}}
+    benchmark.run(datasets, pipelines, report=report, workdir=workdir, options=options)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Neuron Segmentation',
+        argument_default=argparse.SUPPRESS
+    )
+    options = parser.add_subparsers()
+
+    # Scoring
+    op = options.add_parser('score', description='score a prediction against the ground truth',
+                            argument_default=argparse.SUPPRESS)
+    op.add_argument('truth', help='ground-truth regions (.json)')
+    op.add_argument('prediction', help='predicted regions (.json, or the .npz sidecar)')
+    op.add_argument('--threshold', type=float, help='max distance between matched centers [Default: 5]')
+    op.set_defaults(func=score)
+
+    # Benchmark
+    op = options.add_parser('benchmark', description='time the ThunderNMF, CNMF and UNET pipelines stage by stage',
+                            argument_default=argparse.SUPPRESS)
+    op.add_argument('--datasets', nargs='+', help='neurofinder dataset folders (images/ and optionally regions/regions.json)')
+    op.add_argument('--synthetic', nargs=4, type=int, metavar=('T', 'H', 'W', 'NEURONS'), action='append',
+                    help='also generate a synthetic dataset of this size; can be repeated')
+    op.add_argument('--seed', type=int, help='random seed of the synthetic datasets [Default: 0]')
+    op.add_argument('--pipelines', nargs='+', choices=list(benchmark.PIPELINES), help='pipelines to run [Default: all]')
+    op.add_argument('--n_workers', type=int, help='processes of the ThunderNMF block engine and CNMF cluster')
+    op.add_argument('--unet_model', help='trained Unet checkpoint, needed to benchmark UNET')
+    op.add_argument('--workdir', help='scratch folder for the datasets and outputs [Default: benchmark]')
+    op.add_argument('--report', help='path of the json report [Default: benchmark.json]')
+    op.set_defaults(func=run_benchmark)
+    args = parser.parse_args(argv)
+
+    if hasattr(args, 'func'):
+        args = vars(args)
+        func = args.pop('func')
+        func(**args)
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+'''
+Benchmark of the ThunderNMF, CNMF and UNET pipelines on the same data.
+Every pipeline is run stage by stage (loading, filtering, extraction, merging,
+post-processing, ...), and each stage records its wall time, the peak resident
+memory of the process and its children while it runs, and the bytes read and
+written (see IO_KEYS), its worker processes included. The datasets are synthetic movies of any size, generated
+locally (see Common.synthetic), and/or neurofinder folders on disk. The report
+is a json file, tagged with the git commit, to compare versions:
+    python -m Common benchmark --synthetic 1000 256 256 50 --pipelines ThunderNMF CNMF
+A pipeline whose dependencies do not import in this interpreter (e.g. UNET needs
+Python 2.7 and tensorflow) is reported as skipped, with the reason.
+'''
+
+from __future__ import division
+import os
+import sys
+import json
+import time
+import platform
+import threading
+import subprocess
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from .frames import list_frames
+from .moviecache import MovieCache
+from .predictions import write_dataset
+from .scoring import score, load_pixels, region_pixels
+from .synthetic import synthetic_movie, save_neurofinder
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# bytes read from / written to storage, and bytes passed to read / write calls;
+# the former misses reads served by the page cache, the latter memmap accesses
+IO_KEYS = ['read_bytes', 'write_bytes', 'read_chars', 'write_chars']
+
+# movie cache of the scratch folder, shared by the pipelines of a run
+CACHE = 'movie_cache'
+
+class Recorder(object):
+    '''
+    Collects the measurements of the stages of one pipeline run.
+    '''
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        Measure the block run under this stage name.
+        '''
+        peak = [_rss()]
+        done = threading.Event()
+        # last counters seen of every child, so that workers exiting during the
+        # stage still count
+        children_before = _children_io()
+        children = dict(children_before)
+
+        def sample():
+            while not done.wait(self.interval):
+                peak[0] = max(peak[0], _rss())
+                children.update(_children_io())
+        sampler = threading.Thread(target=sample)
+        sampler.daemon = True
+        before = _io()
+        start = time.time()
+        sampler.start()
+        try:
+            yield
+        finally:
+            seconds = time.time() - start
+            done.set()
+            sampler.join()
+            peak[0] = max(peak[0], _rss())
+            children.update(_children_io())
+            after = _io()
+            measures = OrderedDict([('stage', name), ('seconds', seconds), ('peak_rss_bytes', peak[0])])
+            for key in IO_KEYS:
+                if key in before and key in after:
+                    delta = after[key] - before[key] + sum(counters.get(key, 0) - children_before.get(pid, {}).get(key, 0)
+                                                           for pid, counters in children.items())
+                    measures[key] = max(delta, 0)
+            self.stages.append(measures)
+            print('  {:<14} {:8.2f}s  peak {:8.1f} MB'.format(name, seconds, peak[0] / 2 ** 20))
+
+def thundernmf(path, recorder, k=5, percentile=99, max_iter=50, overlap=0.1, chunk_size=32, padding=25,
+               merge=0.1, n_workers=None):
+    '''
+    ThunderNMF: load, median filter, block NMF, merge.
+    Output: the predicted regions.
+    '''
+    from extraction import NMF
+    import ThunderNMF
+    from ThunderNMF.blocks import fit_blocks
+    from ThunderNMF.merge import merge_regions
+    with recorder.stage('load'):
+        images = _movie(path).movie()
+    parallel = n_workers is not None and n_workers > 1
+    with recorder.stage('median_filter'):
+        out = np.memmap('filtered.mmap', mode='w+', dtype=np.uint8, shape=images.shape) if parallel else None
+        images = ThunderNMF.medianFilter(images, out=out)
+    with recorder.stage('nmf'):
+        algorithm = NMF(k=k, percentile=percentile, max_iter=max_iter, overlap=overlap)
+        model = fit_blocks(images, algorithm, (chunk_size, chunk_size), (padding, padding), n_workers=n_workers)
+    with recorder.stage('merge'):
+        regions = merge_regions([region.coordinates for region in model.regions], merge)
+    if parallel:
+        del images, out
+        os.remove('filtered.mmap')
+    return regions
+
+def cnmf(path, recorder, k=1000, g=5, merge=0.8, n_processes=None):
+    '''
+    CNMF: memory map the movie, CaImAn CNMF, sparse components to regions.
+    Output: the predicted regions.
+    '''
+    from CNMF import CNMF_PROCESS, sparse_to_regions
+    if not os.path.isdir('figures'):
+        os.makedirs('figures')
+    with recorder.stage('memmap'):
+        movie = _movie(path).yr_path
+    with recorder.stage('cnmf'):
+        pixels, dims = CNMF_PROCESS(movie, k, g, merge, dataset_name=os.path.basename(path.rstrip('/')),
+                                    n_processes=n_processes)
+    with recorder.stage('regions'):
+        regions = sparse_to_regions(pixels, dims)
+    return regions
+
+def unet(path, recorder, model=None, layers=4, features=64, tile=None, batch=4):
+    '''
+    UNET: summary image, prediction with a trained checkpoint, post-processing.
+    Output: the predicted regions.
+    '''
+    if model is None:
+        raise ImportError('UNET needs a trained checkpoint (--unet_model)')
+    from UNET.predictor import Predictor, summary_image
+    from UNET.postprocess import segment, label_regions
+    with recorder.stage('summary'):
+        image = summary_image(path, CACHE)
+    with recorder.stage('predict'):
+        with Predictor(model, layers=layers, features=features) as predictor:
+            probability = predictor.predict([image], batch_size=batch, tile=tile)[0][..., 1]
+    with recorder.stage('postprocess'):
+        regions = label_regions(segment(probability))
+    return regions
+
+PIPELINES = OrderedDict([('ThunderNMF', thundernmf), ('CNMF', cnmf), ('UNET', unet)])
+
+def run(datasets, pipelines=list(PIPELINES), report='benchmark.json', workdir='benchmark', options=None):
+    '''
+    Run the pipelines on every dataset and write the report.
+    Input: the neurofinder dataset folders (with images/ and, to be scored,
+    regions/regions.json), the names of the pipelines, the path of the json
+    report, the scratch folder the pipelines run in, and a dict of keyword
+    arguments per pipeline name.
+    The frames of every dataset are decoded into the movie cache before the
+    pipelines run, and reported on their own (decode), so the order of the
+    pipelines does not change their timings.
+    Output: the report, as a dict.
+    '''
+    options = options or {}
+    datasets = [os.path.abspath(path) for path in datasets]
+    report_path = os.path.abspath(report)
+    results = []
+    decoding = []
+    cwd = os.getcwd()
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    os.chdir(workdir)
+    try:
+        for path in datasets:
+            name = os.path.basename(path.rstrip('/')).replace('neurofinder.', '')
+            truth = os.path.join(path, 'regions', 'regions.json')
+            # decode into the movie cache up front, so no pipeline pays for it
+            print('decode {}'.format(name))
+            recorder = Recorder()
+            with recorder.stage('decode'):
+                _movie(path)
+            decoded = OrderedDict([('dataset', name)])
+            decoded.update((key, value) for key, value in recorder.stages[0].items() if key != 'stage')
+            decoding.append(decoded)
+            for pipeline in pipelines:
+                print('{} on {}'.format(pipeline, name))
+                recorder = Recorder()
+                result = OrderedDict([('pipeline', pipeline), ('dataset', name)])
+                try:
+                    regions = PIPELINES[pipeline](path, recorder, **options.get(pipeline, {}))
+                except ImportError as e:
+                    print('  skipped: {}'.format(e))
+                    result['skipped'] = str(e)
+                    results.append(result)
+                    continue
+                with recorder.stage('write'):
+                    write_dataset('{}-{}.json'.format(pipeline, name), name, regions)
+                result['stages'] = recorder.stages
+                result['seconds'] = sum(stage['seconds'] for stage in recorder.stages)
+                result['peak_rss_bytes'] = max(stage['peak_rss_bytes'] for stage in recorder.stages)
+                result['regions'] = len(regions)
+                if os.path.exists(truth):
+                    result['scores'] = score(load_pixels(truth)[None], region_pixels(regions))
+                results.append(result)
+    finally:
+        os.chdir(cwd)
+
+    content = OrderedDict([('commit', _commit()), ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                           ('python', platform.python_version()), ('machine', platform.node()),
+                           ('cpus', _cpus()), ('datasets', datasets), ('decode', decoding),
+                           ('results', results)])
+    with open(report_path, 'w') as f:
+        json.dump(content, f, indent=2)
+    print('Report written to {}'.format(report_path))
+    return content
+
+def synthetic(root, T=1000, H=256, W=256, neurons=50, seed=0):
+    '''
+    Generate a synthetic neurofinder dataset under root, unless it already exists.
+    Output: the dataset folder.
+    '''
+    path = os.path.join(root, 'neurofinder.synthetic-{}x{}x{}-{}-{}.test'.format(T, H, W, neurons, seed))
+    if not os.path.exists(os.path.join(path, 'regions', 'regions.json')):
+        print('Generating {}'.format(path))
+        movie, regions = synthetic_movie(T=T, H=H, W=W, neurons=neurons, seed=seed)
+        save_neurofinder(path, movie, regions)
+    return path
+
+def _movie(path):
+    '''
+    helper function for run and the pipelines; the cached movie of a dataset,
+    decoded by run before the pipelines, which only memory map it.
+    '''
+    name = os.path.basename(path.rstrip('/')).replace('neurofinder.', '')
+    return MovieCache(CACHE).get(name, list_frames(os.path.join(path, 'images')))
+
+def _rss():
+    '''
+    helper function for Recorder; resident memory of this process and its children.
+    '''
+    if psutil is not None:
+        process = psutil.Process()
+        total = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+def _io():
+    '''
+    helper function for Recorder; the IO_KEYS counters of this process so far
+    (with psutil or /proc), plus the storage bytes of its children that exited
+    (RUSAGE_CHILDREN) when psutil cannot follow the children; the counters
+    unknown on this platform are left out.
+    '''
+    if psutil is not None:
+        try:
+            counters = psutil.Process().io_counters()
+            return dict((key, getattr(counters, key)) for key in IO_KEYS if hasattr(counters, key))
+        except (AttributeError, psutil.Error):
+            pass
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines())
+    except (IOError, OSError):
+        return {}
+    names = {'read_bytes': 'read_bytes', 'write_bytes': 'write_bytes', 'read_chars': 'rchar', 'write_chars': 'wchar'}
+    counters = dict((key, int(fields[names[key]])) for key in IO_KEYS if names[key] in fields)
+    if psutil is None:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        for key, blocks in [('read_bytes', usage.ru_inblock), ('write_bytes', usage.ru_oublock)]:
+            if key in counters:
+                counters[key] += blocks * 512
+    return counters
+
+def _children_io():
+    '''
+    helper function for Recorder; the IO_KEYS counters of the live children of
+    this process, by pid (empty without psutil).
+    '''
+    if psutil is None:
+        return {}
+    counters = {}
+    try:
+        children = psutil.Process().children(recursive=True)
+    except psutil.Error:
+        return {}
+    for child in children:
+        try:
+            io = child.io_counters()
+        except (AttributeError, psutil.Error):
+            continue
+        counters[child.pid] = dict((key, getattr(io, key)) for key in IO_KEYS if hasattr(io, key))
+    return counters
+
+def _commit():
+    '''
+    helper function for run; the git commit of the code being benchmarked.
+    '''
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _cpus():
+    '''
+    helper function for run.
+    '''
+    import multiprocessing
+    return multiprocessing.cpu_count()
@@ -0,0 +1,57 @@
+'''
+Whole-stack filters shared by the ThunderNMF and UNET preprocessing.
+The filters work on a (T, H, W) movie at once: the stack is cut into chunks of
+frames, the chunks are filtered by a pool of processes, and the results are
+written into one preallocated array (which can be a memmap). For instance,
+    binary = binary_median(frames, size=3)
+'''
+
+from multiprocessing import Pool, cpu_count
+import numpy as np
+import scipy.ndimage as ndimg
+
+def binary_median(stack, size=3, chunk_size=100, n_processes=None, out=None, dtype=np.uint8):
+    '''
+    Binarize every frame at its own median, then median filter the binary frames.
+    This is the stack version of thresholding img > np.median(img) followed by
+    skimage.filters.median(img, morphology.square(size)) on every frame.
+    Input: a (T, H, W) stack, the width of the square footprint, the number of
+    frames handed to a worker at a time, the number of processes [Default: number
+    of cores], an optional (T, H, W) array to write into and the output dtype.
+    Output: a (T, H, W) array of 0/1 values.
+    '''
+    if out is None:
+        out = np.empty(stack.shape, dtype=dtype)
+    elif out.shape != stack.shape:
+        raise ValueError('Output shape {} does not match stack shape {}'.format(out.shape, stack.shape))
+
+    starts = range(0, len(stack), chunk_size)
+    n_processes = min(n_processes or cpu_count(), len(starts))
+    if n_processes <= 1:
+        for start in starts:
+            out[start:start + chunk_size] = _binary_median_chunk((stack[start:start + chunk_size], size))
+        return out
+
+    pool = Pool(n_processes)
+    try:
+        chunks = ((stack[start:start + chunk_size], size) for start in starts)
+        for start, filtered in zip(starts, pool.imap(_binary_median_chunk, chunks)):
+            out[start:start + chunk_size] = filtered
+    finally:
+        pool.terminate()
+    return out
+
+def _binary_median_chunk(args):
+    '''
+    helper function for binary_median, run by the workers on one chunk.
+    The median of a binary window is a majority vote, so it is computed as a
+    count of the pixels above the median with one correlation over the chunk.
+    '''
+    chunk, size = args
+    n = len(chunk)
+    # per-frame medians in one reduction over the flattened frames
+    medians = np.median(chunk.reshape(n, -1), axis=1)
+    # int32 counts: a uint8 sum overflows for windows of 256 pixels or more
+    binary = (chunk > medians[:, None, None]).astype(np.int32)
+    counts = ndimg.correlate(binary, np.ones((1, size, size), dtype=np.int32), mode='nearest')
+    return 2 * counts > size * size
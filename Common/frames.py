@@ -0,0 +1,107 @@
+'''
+Frame loading shared by the ThunderNMF, UNET and CNMF pipelines.
+A neurofinder movie is stored as one single-channel 16-bit .tiff per frame, so
+the frames are decoded directly as grayscale (no BGR detour) by a pool of
+threads. OpenCV releases the GIL while decoding, so the threads really run in
+parallel. To read a whole dataset into one (T, H, W) array, just call:
+    frames = read_frames(list_frames(dirname))
+or, to walk through it chunk by chunk with bounded memory:
+    for chunk in iter_frames(list_frames(dirname), chunk_size=200):
+        ...
+'''
+
+import re
+from glob import glob
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+import cv2
+import numpy as np
+
+def list_frames(dirname, pattern='*.tiff'):
+    '''
+    List the frame files of a dataset in temporal order.
+    Files are sorted by the numbers in their names, so image2.tiff comes before
+    image10.tiff even when the indices are not zero padded.
+    Input: the folder holding the frames and the glob pattern of the frames.
+    Output: a list of file names.
+    '''
+    files = glob('{}/{}'.format(dirname.rstrip('/'), pattern))
+    return sorted(files, key=_natural_key)
+
+def read_frames(files, n_workers=None, dtype=np.uint16, out=None):
+    '''
+    Read all frames into one preallocated (T, H, W) array using a thread pool.
+    Input: a list of frame files, the number of reading threads [Default: number
+    of cores], the dtype of the result and optionally an array (or memmap) of
+    shape (T, H, W) to read into.
+    Output: a (T, H, W) array holding the frames in the order of files.
+    An empty list of files gives an empty (0, 0, 0) array.
+    '''
+    if len(files) == 0:
+        return np.empty((0, 0, 0), dtype=dtype) if out is None else out
+    first = _read_frame(files[0])
+    shape = (len(files),) + first.shape
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError('Output shape {} does not match frames shape {}'.format(out.shape, shape))
+    out[0] = first
+
+    def fill(i):
+        frame = _read_frame(files[i])
+        if frame.shape != first.shape:
+            raise ValueError('Frame {} has shape {}, expected {}'.format(files[i], frame.shape, first.shape))
+        out[i] = frame
+
+    pool = ThreadPool(n_workers or cpu_count())
+    try:
+        pool.map(fill, range(1, len(files)))
+    finally:
+        pool.terminate()
+    return out
+
+def iter_frames(files, chunk_size=100, n_workers=None, dtype=np.uint16):
+    '''
+    Generator reading the frames chunk by chunk.
+    The next chunk is decoded in the background while the current one is being
+    used, so only two chunks are ever held in memory.
+    Input: a list of frame files, the number of frames per chunk, the number of
+    reading threads [Default: number of cores] and the dtype of the chunks.
+    Output: yields (n, H, W) arrays, n <= chunk_size, in temporal order.
+    '''
+    pool = ThreadPool(n_workers or cpu_count())
+    try:
+        pending = pool.map_async(_read_frame, files[:chunk_size])
+        for start in range(0, len(files), chunk_size):
+            frames = pending.get()
+            following = files[start + chunk_size:start + 2 * chunk_size]
+            if following:
+                pending = pool.map_async(_read_frame, following)
+            if any(frame.shape != frames[0].shape for frame in frames):
+                raise ValueError('Frames {}-{} do not share the same shape'.format(start, start + len(frames)))
+            yield np.array(frames, dtype=dtype)
+    finally:
+        pool.terminate()
+
+def frame_shape(file):
+    '''
+    The (H, W) shape of a single frame, without starting a pool of threads.
+    Input: a frame file.
+    Output: a tuple (H, W).
+    '''
+    return _read_frame(file).shape
+
+def _read_frame(file):
+    '''
+    helper function reading a single frame as a 2D array, keeping its bit depth.
+    '''
+    frame = cv2.imread(file, cv2.IMREAD_ANYDEPTH)
+    if frame is None:
+        raise IOError('Could not read frame {}'.format(file))
+    return frame
+
+def _natural_key(name):
+    '''
+    helper function for list_frames; splits a name into text and numbers.
+    '''
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
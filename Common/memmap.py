@@ -0,0 +1,66 @@
+'''
+Streaming writer from .tiff frames to the memory mapped layout used by CaImAn.
+CaImAn works on a float32 (H * W, T) matrix Yr stored in F order, in a file
+named <base_name>_d1_<H>_d2_<W>_d3_1_order_F_frames_<T>_.mmap that
+caiman.load_memmap knows how to open. The frames are streamed into it chunk by
+chunk, so the movie is never held in memory as a whole:
+    fname, add_to_movie = save_memmap(list_frames(dirname), base_name='Yr')
+'''
+
+import os
+import numpy as np
+from .frames import iter_frames
+
+def save_memmap(files, base_name='Yr', dirname='.', chunk_size=200, n_workers=None, movie_path=None,
+                dtype=np.uint16):
+    '''
+    Stream frames into an F-ordered Yr memmap.
+    The running minimum of the frames is tracked on the fly; if the movie has
+    negative values, add_to_movie = -minimum is added to Yr in a second pass over
+    the memmap, chunk by chunk, to make the data non-negative.
+    base_name must not contain underscores, which caiman.load_memmap splits on.
+    Input: the frame files in temporal order, the base name and folder of the
+    memmap, the number of frames per chunk, the number of reading threads, an
+    optional path to also write the raw (T, H, W) frames as a C-ordered memmap and
+    the dtype the frames are decoded to.
+    Output: the path of the Yr memmap and the value added to the movie.
+    '''
+    if not files:
+        raise ValueError('no frames to save')
+    if '_' in base_name:
+        raise ValueError('base_name {} must not contain underscores'.format(base_name))
+    T = len(files)
+    Yr, movie = None, None
+    minimum = np.inf
+    start = 0
+    for chunk in iter_frames(files, chunk_size=chunk_size, n_workers=n_workers, dtype=dtype):
+        if Yr is None:
+            d1, d2 = chunk.shape[1:]
+            fname = os.path.join(dirname, '{}_d1_{}_d2_{}_d3_1_order_F_frames_{}_.mmap'.format(base_name, d1, d2, T))
+            Yr = np.memmap(fname, mode='w+', dtype=np.float32, shape=(d1 * d2, T), order='F')
+            if movie_path is not None:
+                movie = np.memmap(movie_path, mode='w+', dtype=chunk.dtype, shape=(T, d1, d2), order='C')
+        n = len(chunk)
+        # columns of an F-ordered Yr are frames flattened in F order
+        Yr[:, start:start + n] = chunk.transpose(0, 2, 1).reshape(n, -1).T
+        if movie is not None:
+            movie[start:start + n] = chunk
+        minimum = min(minimum, chunk.min())
+        start += n
+
+    add_to_movie = max(0., -float(minimum))
+    if add_to_movie > 0:
+        for start in range(0, T, chunk_size):
+            Yr[:, start:start + chunk_size] += add_to_movie
+    Yr.flush()
+    if movie is not None:
+        movie.flush()
+    return fname, add_to_movie
+
+def memmap_dims(fname):
+    '''
+    Read the dimensions back from the name of a Yr memmap, like caiman.load_memmap.
+    Output: (d1, d2) and the number of frames T.
+    '''
+    fpart = os.path.basename(fname).split('_')[1:-1]
+    return (int(fpart[1]), int(fpart[3])), int(fpart[9])
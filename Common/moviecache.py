@@ -0,0 +1,134 @@
+'''
+On-disk movie cache shared by the CNMF, ThunderNMF and UNET entry points.
+Decoding a neurofinder folder of .tiff frames is the slowest part of loading a
+dataset, so every dataset is decoded once and kept as two memory-mapped copies:
+    movie_C.mmap    the raw (T, H, W) uint16 frames in C order, used by
+                    ThunderNMF and UNET;
+    Yr_d1_..._.mmap the float32 (H * W, T) matrix in F order, the layout and
+                    file name CaImAn's load_memmap expects, used by CNMF
+                    (written by Common.memmap.save_memmap).
+An entry is keyed by the dataset name and a fingerprint of the source frames
+(their names, sizes and modification times), so a second run, or another
+algorithm on the same dataset, reuses it without touching the frames:
+    cache = MovieCache('movie_cache')
+    entry = cache.get('00.00.test', list_frames('neurofinder.00.00.test/images'))
+    frames = entry.movie()
+'''
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+from .memmap import save_memmap, memmap_dims
+
+class MovieCache(object):
+    '''
+    A folder of cached movies, one sub-folder per dataset and fingerprint.
+    '''
+
+    def __init__(self, root='movie_cache'):
+        self.root = root
+
+    def get(self, name, files, chunk_size=200, n_workers=None):
+        '''
+        Return the cached movie of a dataset, creating it if needed.
+        Entries of the same dataset with an outdated fingerprint are removed.
+        Input: the dataset name (e.g. 00.00.test), its frame files in temporal
+        order, the number of frames decoded at a time and the number of reading threads.
+        Output: a CachedMovie.
+        '''
+        if not files:
+            raise ValueError('No frames to cache for {}'.format(name))
+        path = os.path.join(self.root, '{}-{}'.format(name, fingerprint(files)))
+        if os.path.exists(os.path.join(path, CachedMovie.INFO)):
+            return CachedMovie(path)
+
+        print('Caching {} frames of {} into {}'.format(len(files), name, path))
+        self._clear(name)
+        tmp = '{}.tmp-{}'.format(path, os.getpid())
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        try:
+            _write_entry(tmp, files, chunk_size, n_workers)
+            os.rename(tmp, path)
+        except OSError:
+            # another process finished caching the same dataset first
+            if not os.path.exists(os.path.join(path, CachedMovie.INFO)):
+                raise
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp)
+        return CachedMovie(path)
+
+    def _clear(self, name):
+        '''
+        helper function for get; removes the outdated entries of a dataset.
+        '''
+        if not os.path.isdir(self.root):
+            return
+        for entry in os.listdir(self.root):
+            if entry.rsplit('-', 1)[0] == name and '.tmp-' not in entry:
+                shutil.rmtree(os.path.join(self.root, entry))
+
+class CachedMovie(object):
+    '''
+    One cached dataset. The memmaps are opened read-only by default.
+    '''
+    INFO = 'info.json'
+    MOVIE = 'movie_C.mmap'
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, self.INFO)) as f:
+            info = json.load(f)
+        self.shape = tuple(info['shape'])
+        self.dtype = np.dtype(info['dtype'])
+        self.yr_name = info['yr_name']
+        self.add_to_movie = info['add_to_movie']
+
+    @property
+    def yr_path(self):
+        '''
+        Path of the F-ordered Yr memmap, to hand to caiman.load_memmap.
+        '''
+        return os.path.join(self.path, self.yr_name)
+
+    def movie(self, mode='r'):
+        '''
+        The (T, H, W) frames as a C-ordered memmap.
+        '''
+        return np.memmap(os.path.join(self.path, self.MOVIE), mode=mode,
+                         dtype=self.dtype, shape=self.shape, order='C')
+
+    def Yr(self, mode='r'):
+        '''
+        The (H * W, T) float32 pixels-by-frames matrix as an F-ordered memmap.
+        '''
+        T, d1, d2 = self.shape
+        return np.memmap(self.yr_path, mode=mode, dtype=np.float32,
+                         shape=(d1 * d2, T), order='F')
+
+def fingerprint(files):
+    '''
+    Hash of the names, sizes and modification times of the source frames.
+    '''
+    digest = hashlib.sha1()
+    for f in files:
+        stat = os.stat(f)
+        digest.update('{}:{}:{}\n'.format(os.path.basename(f), stat.st_size, stat.st_mtime).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def _write_entry(path, files, chunk_size, n_workers):
+    '''
+    helper function for MovieCache.get; decodes the frames once, chunk by chunk,
+    into both memmaps and writes info.json last to mark the entry complete.
+    '''
+    yr_path, add_to_movie = save_memmap(files, base_name='Yr', dirname=path, chunk_size=chunk_size,
+                                        n_workers=n_workers, movie_path=os.path.join(path, CachedMovie.MOVIE))
+    (d1, d2), T = memmap_dims(yr_path)
+    info = {'shape': [T, d1, d2], 'dtype': np.dtype(np.uint16).name, 'yr_name': os.path.basename(yr_path),
+            'add_to_movie': add_to_movie, 'files': len(files), 'fingerprint': fingerprint(files)}
+    with open(os.path.join(path, CachedMovie.INFO), 'w') as f:
+        json.dump(info, f)
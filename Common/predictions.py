@@ -0,0 +1,181 @@
+'''
+Streaming writer for neurofinder prediction files.
+The regions of each dataset are written to disk as soon as the dataset is done,
+instead of keeping every [x, y] pair of every dataset as Python lists until a
+final json.dump. A compact sidecar can be written next to the json: an .npz
+holding the run-length encoded mask of every region, which the scorer reads
+without any JSON parsing. For instance,
+    with PredictionWriter('submission.json', sidecar='submission.npz') as writer:
+        for name, regions, dims in results:
+            writer.write(name, regions, dims)
+The files are written under a temporary name and only renamed into place once
+the writer is closed without error, so a reader never sees half a prediction.
+'''
+
+import io
+import os
+import json
+import zipfile
+from collections import OrderedDict
+import numpy as np
+
+class PredictionWriter(object):
+    '''
+    Writes a submission (a list of {"dataset", "regions"}) one dataset at a time.
+    '''
+
+    def __init__(self, path, sidecar=None):
+        self.path = path
+        self.sidecar = sidecar
+        self.datasets = []
+        self._file = open(_tmp(path), 'w')
+        self._file.write('[')
+        self._zip = None
+        if sidecar is not None:
+            self._zip = zipfile.ZipFile(_tmp(sidecar), 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def write(self, dataset, regions, dims=None):
+        '''
+        Append the regions of one dataset.
+        Input: the dataset name, its regions (coordinate arrays or lists, or
+        {"coordinates": ...} dicts, any iterable) and the (H, W) shape of the
+        FOV, needed for the sidecar only.
+        '''
+        if self.datasets:
+            self._file.write(', ')
+        coordinates = _dump_dataset(self._file, dataset, regions, keep=self._zip is not None)
+        if self._zip is not None:
+            if dims is None:
+                raise ValueError('dims of {} are needed to write the sidecar'.format(dataset))
+            _write_runs(self._zip, dataset, coordinates, dims)
+        self.datasets.append(dataset)
+
+    def close(self):
+        '''
+        Finish the files and move them into place.
+        '''
+        self._file.write(']')
+        self._file.close()
+        os.rename(_tmp(self.path), self.path)
+        if self._zip is not None:
+            _write_array(self._zip, 'datasets', np.array(self.datasets, dtype=str))
+            self._zip.close()
+            os.rename(_tmp(self.sidecar), self.sidecar)
+
+    def discard(self):
+        '''
+        Drop the partially written files.
+        '''
+        self._file.close()
+        os.remove(_tmp(self.path))
+        if self._zip is not None:
+            self._zip.close()
+            os.remove(_tmp(self.sidecar))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+        return False
+
+def write_dataset(path, dataset, regions, dims=None):
+    '''
+    Stream the prediction of a single dataset ({"dataset", "regions"}) to path,
+    under a temporary name renamed into place once complete.
+    If given, the (H, W) shape of the FOV is kept in a "dims" entry, so the
+    prediction can later be added to a PredictionWriter with its sidecar.
+    '''
+    with open(_tmp(path), 'w') as f:
+        _dump_dataset(f, dataset, regions, dims=dims)
+    os.rename(_tmp(path), path)
+
+def read_sidecar(path):
+    '''
+    Read the masks written next to a prediction.
+    Output: an ordered dict of dataset -> dict with the FOV 'dims' and the masks
+    as CSR-like 'indices' (linear pixel indices, C order) and 'indptr' (the
+    indices of region i are indices[indptr[i]:indptr[i + 1]]).
+    '''
+    masks = OrderedDict()
+    with np.load(path) as data:
+        for dataset in data['datasets']:
+            starts = data['{}/starts'.format(dataset)]
+            lengths = data['{}/lengths'.format(dataset)]
+            # expand every run into its consecutive indices
+            offsets = np.concatenate(([0], np.cumsum(lengths)))
+            run = np.repeat(np.arange(len(starts)), lengths)
+            indices = starts[run] + np.arange(offsets[-1]) - offsets[run]
+            masks[str(dataset)] = {'dims': tuple(int(d) for d in data['{}/dims'.format(dataset)]),
+                                   'indices': indices,
+                                   'indptr': offsets[data['{}/runs'.format(dataset)]]}
+    return masks
+
+def _dump_dataset(f, dataset, regions, keep=False, dims=None):
+    '''
+    helper function writing one {"dataset", "regions"} object region by region,
+    with the "dims" of the FOV if given.
+    Returns the coordinates as arrays if keep is True.
+    '''
+    kept = []
+    f.write('{{"dataset": {}, "regions": ['.format(json.dumps(dataset)))
+    for i, region in enumerate(regions):
+        if isinstance(region, dict):
+            region = region['coordinates']
+        if i:
+            f.write(', ')
+        f.write('{{"coordinates": {}}}'.format(json.dumps(np.asarray(region).tolist())))
+        if keep:
+            kept.append(np.asarray(region, dtype=np.int64).reshape(-1, 2))
+    f.write(']')
+    if dims is not None:
+        f.write(', "dims": {}'.format(json.dumps([int(d) for d in dims])))
+    f.write('}')
+    return kept
+
+def _write_runs(zipf, dataset, coordinates, dims):
+    '''
+    helper function run-length encoding the masks of one dataset into the sidecar.
+    All regions are encoded in one pass: the linear indices of every region are
+    sorted together, and a run breaks wherever the region changes or the next
+    index is not consecutive.
+    '''
+    n = len(coordinates)
+    sizes = np.array([len(c) for c in coordinates], dtype=np.int64)
+    region = np.repeat(np.arange(n), sizes)
+    if len(region):
+        stacked = np.concatenate(coordinates)
+        linear = np.ravel_multi_index((stacked[:, 0], stacked[:, 1]), dims)
+    else:
+        linear = np.zeros(0, dtype=np.int64)
+    order = np.lexsort((linear, region))
+    linear, region = linear[order], region[order]
+    keep = np.ones(len(linear), dtype=bool)
+    keep[1:] = (np.diff(linear) != 0) | (np.diff(region) != 0)
+    linear, region = linear[keep], region[keep]
+    breaks = np.ones(len(linear), dtype=bool)
+    breaks[1:] = (np.diff(linear) != 1) | (np.diff(region) != 0)
+    starts = np.flatnonzero(breaks)
+    lengths = np.diff(np.concatenate((starts, [len(linear)])))
+    # runs[i] is the index of the first run of region i
+    runs = np.searchsorted(region[starts], np.arange(n + 1))
+    arrays = {'starts': linear[starts], 'lengths': lengths, 'runs': runs, 'dims': np.asarray(dims)}
+    for key, array in arrays.items():
+        _write_array(zipf, '{}/{}'.format(dataset, key), array)
+
+def _write_array(zipf, name, array):
+    '''
+    helper function adding one array to an .npz being written.
+    '''
+    buf = io.BytesIO()
+    np.lib.format.write_array(buf, np.asarray(array), allow_pickle=False)
+    zipf.writestr(name + '.npy', buf.getvalue())
+
+def _tmp(path):
+    '''
+    helper function; temporary name of a file being written.
+    '''
+    return '{}.tmp-{}'.format(path, os.getpid())
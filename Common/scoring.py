@@ -0,0 +1,152 @@
+'''
+Neurofinder scores: recall, precision, inclusion, exclusion and combined.
+Regions are matched by their centers: every ground-truth region can be matched
+to at most one predicted region within `threshold` pixels, choosing the
+assignment of minimal total distance (Hungarian algorithm). Then
+    recall    = matched regions / ground-truth regions
+    precision = matched regions / predicted regions
+    inclusion = mean over matches of intersecting pixels / ground-truth pixels
+    exclusion = mean over matches of intersecting pixels / predicted pixels
+    combined  = 2 * recall * precision / (recall + precision)
+No Python loop runs over regions or pixels: both sets are rasterized into sparse
+(regions x pixels) label matrices, all pairwise overlaps come from one sparse
+matrix product, and candidate pairs come from a KD-tree query. For instance,
+    scores = score_submission('regions.json', 'submission.json')
+The prediction can also be the .npz sidecar of a PredictionWriter, which is
+read without any JSON parsing.
+'''
+
+from __future__ import division
+import json
+from collections import OrderedDict
+import numpy as np
+import scipy.sparse as ss
+from scipy.spatial import cKDTree
+from scipy.optimize import linear_sum_assignment
+from .predictions import read_sidecar
+
+KEYS = ['combined', 'recall', 'precision', 'inclusion', 'exclusion']
+
+def score(truth, prediction, threshold=5):
+    '''
+    Score the predicted regions of one dataset against the ground truth.
+    Input: the ground-truth and predicted regions, each as a list of coordinate
+    lists/arrays (or {"coordinates": ...} dicts) or as the pixels returned by
+    region_pixels, and the maximal distance between matched centers.
+    Output: a dict of the five scores.
+    '''
+    truth = truth if isinstance(truth, tuple) else region_pixels(truth)
+    prediction = prediction if isinstance(prediction, tuple) else region_pixels(prediction)
+    n_truth, n_pred = truth[0], prediction[0]
+    if n_truth == 0 or n_pred == 0:
+        return dict((key, 0.) for key in KEYS)
+    shape = (max(truth[2].max(), prediction[2].max()) + 1,
+             max(truth[3].max(), prediction[3].max()) + 1)
+    A, a_centers = _labels(truth, shape)
+    B, b_centers = _labels(prediction, shape)
+
+    # candidate pairs: centers closer than threshold
+    near = cKDTree(a_centers).query_ball_tree(cKDTree(b_centers), threshold)
+    rows = np.repeat(np.arange(n_truth), [len(n) for n in near])
+    cols = np.array([j for n in near for j in n], dtype=np.int64)
+    distance = np.linalg.norm(a_centers[rows] - b_centers[cols], axis=1)
+    # anything farther than threshold costs more than any valid assignment
+    cost = np.full((n_truth, n_pred), threshold * (n_truth + n_pred) + 1.)
+    cost[rows, cols] = distance
+    ia, ib = linear_sum_assignment(cost)
+    matched = cost[ia, ib] <= threshold
+    ia, ib = ia[matched], ib[matched]
+
+    n_matched = len(ia)
+    recall = n_matched / n_truth
+    precision = n_matched / n_pred
+    combined = 2 * recall * precision / (recall + precision) if n_matched else 0.
+    if n_matched:
+        overlap = np.asarray((A.dot(B.T))[ia, ib]).ravel()
+        a_sizes = np.diff(A.indptr)[ia]
+        b_sizes = np.diff(B.indptr)[ib]
+        inclusion = float(np.mean(overlap / a_sizes))
+        exclusion = float(np.mean(overlap / b_sizes))
+    else:
+        inclusion = exclusion = 0.
+    return {'combined': combined, 'recall': recall, 'precision': precision,
+            'inclusion': inclusion, 'exclusion': exclusion}
+
+def score_submission(truth, prediction, threshold=5):
+    '''
+    Score every dataset of a prediction file against a ground-truth file.
+    Both files are lists of {"dataset", "regions"}; a ground truth given as a
+    bare list of regions (like neurofinder's regions/regions.json) is matched to
+    a prediction holding a single dataset. The prediction can be a .npz sidecar.
+    Output: an ordered dict of dataset -> scores, with the averages under 'mean'.
+    '''
+    truth = load_pixels(truth)
+    prediction = load_pixels(prediction)
+    if list(truth) == [None] and len(prediction) == 1:
+        truth = OrderedDict([(list(prediction)[0], truth[None])])
+    scores = OrderedDict()
+    for dataset in prediction:
+        if dataset in truth:
+            scores[dataset] = score(truth[dataset], prediction[dataset], threshold)
+    if scores:
+        scores['mean'] = dict((key, float(np.mean([s[key] for s in scores.values()]))) for key in KEYS)
+    return scores
+
+def print_scores(scores):
+    '''
+    Print the scores as a table, one dataset per row.
+    '''
+    print('{:<12}'.format('dataset') + ''.join('{:>11}'.format(key) for key in KEYS))
+    for dataset, values in scores.items():
+        print('{:<12}'.format(dataset) + ''.join('{:>11.5f}'.format(values[key]) for key in KEYS))
+
+def load_pixels(path):
+    '''
+    Read the regions of every dataset of a prediction or ground-truth file.
+    Output: an ordered dict of dataset -> region pixels (see region_pixels).
+    '''
+    pixels = OrderedDict()
+    if path.endswith('.npz'):
+        for dataset, masks in read_sidecar(path).items():
+            rows, cols = np.unravel_index(masks['indices'], masks['dims'])
+            ids = np.repeat(np.arange(len(masks['indptr']) - 1), np.diff(masks['indptr']))
+            pixels[dataset] = (len(masks['indptr']) - 1, ids, rows, cols)
+        return pixels
+    with open(path) as f:
+        content = json.load(f)
+    if isinstance(content, dict):
+        content = [content]
+    if content and 'dataset' not in content[0]:
+        pixels[None] = region_pixels(content)
+        return pixels
+    for result in content:
+        pixels[result['dataset']] = region_pixels(result['regions'])
+    return pixels
+
+def region_pixels(regions):
+    '''
+    Flatten a list of regions into arrays.
+    Output: (number of regions, region id of every pixel, rows, columns).
+    '''
+    coordinates = [np.asarray(r['coordinates'] if isinstance(r, dict) else r, dtype=np.int64).reshape(-1, 2)
+                   for r in regions]
+    sizes = [len(c) for c in coordinates]
+    ids = np.repeat(np.arange(len(coordinates)), sizes)
+    stacked = np.concatenate(coordinates) if coordinates else np.zeros((0, 2), dtype=np.int64)
+    return len(coordinates), ids, stacked[:, 0], stacked[:, 1]
+
+def _labels(pixels, shape):
+    '''
+    helper function for score; rasterizes regions into a sparse binary
+    (regions x pixels) matrix and computes the region centers.
+    '''
+    n, ids, rows, cols = pixels
+    height, width = shape
+    labels = ss.csr_matrix((np.ones(len(ids)), (ids, rows * width + cols)), shape=(n, height * width))
+    labels.sum_duplicates()
+    labels.data[:] = 1
+    sizes = np.maximum(np.diff(labels.indptr), 1)
+    ids = np.repeat(np.arange(n), np.diff(labels.indptr))
+    r, c = np.divmod(labels.indices, width)
+    centers = np.column_stack((np.bincount(ids, r, minlength=n), np.bincount(ids, c, minlength=n))) / sizes[:, None]
+    return labels, centers
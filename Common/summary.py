@@ -0,0 +1,146 @@
+'''
+Streaming summary images of a movie: sum, mean, max, std and local correlation.
+The movie is read once, chunk by chunk, and every statistic is updated from the
+same chunk, so memory is bounded by the chunk size whatever the number of frames:
+    summary = SummaryImages(['mean', 'std', 'correlation'])
+    for chunk in iter_frames(files, chunk_size=200):
+        summary.update(chunk)
+    image = summary.stack(['mean', 'std', 'correlation'])
+The variance is merged chunk by chunk with Welford's (Chan's) update. The local
+correlation of a pixel is its temporal correlation with its 8 neighbours,
+averaged (as CaImAn's local_correlations); it comes from running sums of the
+products of neighbouring pixels, shifted by the mean of the first chunk to keep
+the sums well conditioned.
+'''
+
+from __future__ import division
+import numpy as np
+
+STATS = ['sum', 'mean', 'max', 'std', 'correlation']
+
+# half of the 8-neighbourhood; each offset also gives the opposite one
+OFFSETS = [(0, 1), (1, 0), (1, 1), (1, -1)]
+
+class SummaryImages(object):
+    '''
+    Accumulator of the summary images of a (T, H, W) movie. The running sums
+    behind the local correlation are only kept if it is among the stats.
+    '''
+
+    def __init__(self, stats=STATS):
+        self.stats = list(stats)
+        self.count = 0
+        self._sum = self._max = self._mean = self._m2 = None
+        self._shift = self._shifted = self._squares = self._products = None
+
+    def update(self, chunk):
+        '''
+        Add a (n, H, W) chunk of frames.
+        '''
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if not len(chunk):
+            return
+        n = len(chunk)
+        mean = chunk.mean(axis=0)
+        m2 = ((chunk - mean) ** 2).sum(axis=0)
+        if self.count == 0:
+            self._sum = chunk.sum(axis=0)
+            self._max = chunk.max(axis=0)
+            self._mean, self._m2 = mean, m2
+            if 'correlation' in self.stats:
+                self._shift = mean
+                self._shifted = np.zeros_like(mean)
+                self._squares = np.zeros_like(mean)
+                self._products = [np.zeros_like(mean[_overlap(mean.shape, offset)[0]]) for offset in OFFSETS]
+        else:
+            self._sum += chunk.sum(axis=0)
+            np.maximum(self._max, chunk.max(axis=0), out=self._max)
+            total = self.count + n
+            delta = mean - self._mean
+            self._mean = self._mean + delta * (n / total)
+            self._m2 = self._m2 + m2 + delta ** 2 * (self.count * n / total)
+        self.count += n
+        if 'correlation' not in self.stats:
+            return
+
+        centered = chunk - self._shift
+        self._shifted += centered.sum(axis=0)
+        self._squares += (centered ** 2).sum(axis=0)
+        for products, offset in zip(self._products, OFFSETS):
+            first, second = _overlap(self._shift.shape, offset)
+            products += (centered[(slice(None),) + first] * centered[(slice(None),) + second]).sum(axis=0)
+
+    @property
+    def sum(self):
+        return self._sum
+
+    @property
+    def mean(self):
+        return self._mean
+
+    @property
+    def max(self):
+        return self._max
+
+    @property
+    def std(self):
+        return np.sqrt(self._m2 / self.count)
+
+    @property
+    def correlation(self):
+        '''
+        Mean temporal correlation of every pixel with its 8 neighbours.
+        '''
+        mean = self._shifted / self.count
+        std = np.sqrt(np.maximum(self._squares / self.count - mean ** 2, 0))
+        total = np.zeros(mean.shape)
+        neighbours = np.zeros(mean.shape)
+        for products, offset in zip(self._products, OFFSETS):
+            first, second = _overlap(mean.shape, offset)
+            norm = std[first] * std[second]
+            covariance = products / self.count - mean[first] * mean[second]
+            correlation = np.where(norm > 0, covariance / np.where(norm > 0, norm, 1), 0)
+            total[first] += correlation
+            total[second] += correlation
+            neighbours[first] += 1
+            neighbours[second] += 1
+        return total / neighbours
+
+    def result(self, stats=None):
+        '''
+        Output: a dict of the requested summary images [Default: all the stats
+        given at construction], each (H, W).
+        '''
+        stats = self.stats if stats is None else stats
+        if not self.count:
+            raise ValueError('No frames were summarized')
+        unknown = [stat for stat in stats if stat not in self.stats]
+        if unknown:
+            raise ValueError('Not summarized: {}'.format(', '.join(unknown)))
+        return dict((stat, getattr(self, stat)) for stat in stats)
+
+    def stack(self, stats):
+        '''
+        Output: the requested summary images stacked as the channels of an (H, W, len(stats)) image.
+        '''
+        images = self.result(stats)
+        return np.stack([images[stat] for stat in stats], axis=-1)
+
+def summarize(chunks, stats=STATS):
+    '''
+    Summary images of a movie given as an iterable of (n, H, W) chunks, in one pass.
+    Output: a dict of stat -> (H, W) image.
+    '''
+    summary = SummaryImages(stats)
+    for chunk in chunks:
+        summary.update(chunk)
+    return summary.result()
+
+def _overlap(shape, offset):
+    '''
+    helper function for SummaryImages; the slices of a pixel and of its neighbour at offset.
+    '''
+    (height, width), (dr, dc) = shape, offset
+    first = (slice(0, height - dr), slice(max(-dc, 0), width - max(dc, 0)))
+    second = (slice(dr, height), slice(max(dc, 0), width - max(-dc, 0)))
+    return first, second
@@ -0,0 +1,67 @@
+'''
+Synthetic calcium imaging movies, saved in the layout of a neurofinder dataset.
+Neurons are Gaussian-ish blobs with sparse, exponentially decaying calcium
+transients, over a noisy, slowly varying background; the ground-truth regions
+are the pixels of each blob above a fraction of its peak. For instance,
+    movie, regions = synthetic_movie(T=1000, H=256, W=256, neurons=50)
+    path = save_neurofinder('bench/neurofinder.synthetic.test', movie, regions)
+writes bench/neurofinder.synthetic.test/images/image00000.tiff, ... and
+regions/regions.json, which every module reads like a real test set.
+'''
+
+from __future__ import division
+import os
+import json
+import cv2
+import numpy as np
+
+def synthetic_movie(T=1000, H=256, W=256, neurons=50, radius=5, rate=0.02, tau=10., noise=0.1,
+                    baseline=1000., gain=2000., seed=0):
+    '''
+    Generate a movie and its ground truth.
+    Input: the number of frames, the FOV, the number of neurons, their mean radius
+    in pixels, the probability of a spike per frame, the decay time of a transient
+    in frames, the noise relative to the gain, the baseline and the gain of the
+    uint16 intensities, and the random seed.
+    Output: the (T, H, W) uint16 movie and the list of regions, each a list of [row, col].
+    '''
+    random = np.random.RandomState(seed)
+    centers = random.uniform(radius, [H - radius, W - radius], size=(neurons, 2))
+    radii = radius * random.uniform(0.8, 1.2, size=neurons)
+    rows, cols = np.mgrid[:H, :W]
+
+    footprints = np.zeros((neurons, H, W), dtype=np.float32)
+    regions = []
+    for i, ((r, c), s) in enumerate(zip(centers, radii)):
+        footprints[i] = np.exp(-((rows - r) ** 2 + (cols - c) ** 2) / (2 * (s / 2) ** 2))
+        regions.append(np.argwhere(footprints[i] > 0.3).tolist())
+
+    spikes = random.rand(T, neurons) < rate
+    traces = np.zeros((T, neurons), dtype=np.float32)
+    decay = np.exp(-1. / tau)
+    for t in range(T):
+        traces[t] = (traces[t - 1] * decay if t else 0) + spikes[t]
+
+    background = 1 + 0.2 * np.sin(2 * np.pi * (rows / H + cols / W))
+    movie = np.empty((T, H, W), dtype=np.uint16)
+    for t in range(T):
+        frame = background + np.tensordot(traces[t], footprints, axes=1) + noise * random.randn(H, W)
+        movie[t] = np.clip(baseline + gain * frame, 0, 65535)
+    return movie, regions
+
+def save_neurofinder(path, movie, regions=None):
+    '''
+    Save a movie (and its ground truth) as a neurofinder dataset folder.
+    Output: the path of the folder.
+    '''
+    images = os.path.join(path, 'images')
+    if not os.path.isdir(images):
+        os.makedirs(images)
+    for t, frame in enumerate(movie):
+        cv2.imwrite(os.path.join(images, 'image{:05d}.tiff'.format(t)), frame)
+    if regions is not None:
+        if not os.path.isdir(os.path.join(path, 'regions')):
+            os.makedirs(os.path.join(path, 'regions'))
+        with open(os.path.join(path, 'regions', 'regions.json'), 'w') as f:
+            json.dump([{'coordinates': region} for region in regions], f)
+    return path
@@ -1,3 +1,7 @@
 from .preprocess import load, grayScale, medianFilter
+from . import blocks
+from . import blockcache
+from . import merge
 from . import nmf
 from . import preprocess
+from . import sweep
@@ -20,7 +20,7 @@ def info():
     print ('Tensorflow GPU Support')
     print (tf.test.gpu_device_name())
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description='Neuron Segmentation',
         argument_default=argparse.SUPPRESS
@@ -30,18 +30,44 @@ def main():
     op = options.add_parser('info', description='print system info')
     op.set_defaults(func=info)
 
+    # Hyperparameter sweep
+    op = options.add_parser('sweep', description='run nmf over a grid of parameters, filtering each dataset once',
+                            argument_default=argparse.SUPPRESS)
+    op.add_argument('--setName', nargs='+', help='the folder names of testing images')
+    op.add_argument('--base', help='where the files live; default value is the Caesar server')
+    op.add_argument('--_k', nargs='+', type=int, help='k values in nmf')
+    op.add_argument('--_percentile', nargs='+', type=int, help='percentile values in nmf')
+    op.add_argument('--_max_iter', nargs='+', type=int, help='max iterations in nmf')
+    op.add_argument('--_overlap', nargs='+', type=float, help='overlap values in nmf')
+    op.add_argument('--_chunk_size', nargs='+', type=int, help='chunk sizes in the process of nmf')
+    op.add_argument('--_padding', nargs='+', type=int, help='paddings on the images in the process of nmf')
+    op.add_argument('--_merge', nargs='+', type=float, help='merge thresholds of the regions')
+    op.add_argument('--cache', help='folder of the movie cache shared by all modules')
+    op.add_argument('--truth', help='ground-truth regions (.json) to score every configuration against')
+    op.add_argument('--n_workers', type=int, help='number of processes fitting configurations [Default: number of cores]')
+    op.add_argument('--block_cache', help='folder caching the nmf result of every block')
+    op.add_argument('--results', help='path of the results table [Default: sweep.csv]')
+    op.set_defaults(func=ThunderNMF.sweep.main)
+
     # ThunderNMF
     parser.add_argument('--setName', help='the folder names of testing images')
     parser.add_argument('--base', help='where the files live; default value is the Caesar server')
-    parser.add_argument('--_k', help='k value in nmf')
-    parser.add_argument('--_percentile', help='percentile value in nmf')
-    parser.add_argument('--_max_iter', help='max iterations in nmf')
-    parser.add_argument('--_overlap', help='overlap regions in nmf')
-    parser.add_argument('--_chunk_size', help='chunk_size in the process of nmf')
-    parser.add_argument('--_padding', help='pading on the images in the process of nmf')
-    parser.add_argument('--_merge', help='the number of regions to merge in nmf')
+    parser.add_argument('--_k', type=int, help='k value in nmf')
+    parser.add_argument('--_percentile', type=int, help='percentile value in nmf')
+    parser.add_argument('--_max_iter', type=int, help='max iterations in nmf')
+    parser.add_argument('--_overlap', type=float, help='overlap regions in nmf')
+    parser.add_argument('--_chunk_size', type=int, help='chunk_size in the process of nmf')
+    parser.add_argument('--_padding', type=int, help='pading on the images in the process of nmf')
+    parser.add_argument('--_merge', type=float, help='the number of regions to merge in nmf')
+    parser.add_argument('--cache', help='folder of the movie cache shared by all modules; frames are decoded only once')
+    parser.add_argument('--sidecar', action='store_true', help='also write run-length encoded masks to submission.npz for fast scoring')
+    parser.add_argument('--truth', help='ground-truth regions (.json) to score the submission against')
+    parser.add_argument('--out_of_core', action='store_true', help='keep the movie memory mapped and fit nmf block by block')
+    parser.add_argument('--n_workers', type=int, help='number of local processes fitting nmf blocks in parallel')
+    parser.add_argument('--block_cache', help='folder caching the nmf result of every block; reruns with another overlap or merge skip nmf')
+    parser.add_argument('--block_cache_size', type=int, help='size limit of the block cache in MB (default 1024)')
     parser.set_defaults(func=ThunderNMF.nmf.main)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
 
     if hasattr(args, 'func'):
@@ -0,0 +1,114 @@
+'''
+On-disk cache of the per-block NMF results of ThunderNMF.
+A block is factorized from its pixels and from k, percentile, max_iter, min_size
+and max_size only; the overlap threshold is applied afterwards, when the sources
+of a block are merged, and the merge threshold later still, across blocks. So
+the cache stores the unmerged sources of a block under a hash of its content and
+of those five parameters, and a sweep over _overlap or _merge reuses every
+block, while a new _k only factorizes the blocks again.
+The cache is bounded: the entries least recently used are removed once the
+folder grows over max_bytes (unbounded if None). Processes sharing a folder
+should leave eviction to one of them; an entry removed meanwhile is a miss.
+    cache = BlockCache('nmf_cache', max_bytes=2 ** 30)
+    model = fit_blocks(images, algorithm, (32, 32), (25, 25), cache=cache)
+'''
+
+import os
+import hashlib
+import numpy as np
+from regional import one
+
+class BlockCache(object):
+    '''
+    A folder of .npz files, one per block and parameter set.
+    The modification time of an entry records its last use.
+    '''
+    SUFFIX = '.npz'
+
+    def __init__(self, root='nmf_cache', max_bytes=2 ** 30):
+        self.root = root
+        self.max_bytes = max_bytes
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def key(self, block, algorithm):
+        '''
+        Hash of the block pixels and of the parameters of the factorization.
+        Input: the (T, h, w) block and the extraction NMF algorithm.
+        Output: a hex digest naming the entry.
+        '''
+        block = np.ascontiguousarray(block)
+        digest = hashlib.sha1()
+        digest.update('{}:{}:{}:{}:{}:{}:{}\n'.format(block.dtype.str, block.shape, algorithm.k,
+                                                      algorithm.percentile, algorithm.max_iter,
+                                                      algorithm.min_size, algorithm.max_size).encode('utf-8'))
+        digest.update(block.data)
+        return digest.hexdigest()
+
+    def get(self, key):
+        '''
+        Load the sources of a block and mark the entry as used.
+        Output: a list of regional.one in block coordinates, or None on a miss.
+        '''
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = np.load(f)
+                coordinates, lengths = entry['coordinates'], entry['lengths']
+        except (IOError, OSError):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            # evicted by another process since it was read
+            pass
+        return [one(c) for c in np.split(coordinates, np.cumsum(lengths)[:-1])] if len(lengths) else []
+
+    def put(self, key, sources):
+        '''
+        Store the sources of a block; the file is renamed into place once complete.
+        '''
+        lengths = np.array([len(s.coordinates) for s in sources], dtype=np.int64)
+        coordinates = (np.concatenate([s.coordinates for s in sources]) if sources
+                       else np.zeros((0, 2))).astype(np.int32)
+        path = self._path(key)
+        tmp = '{}.tmp-{}'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.savez(f, coordinates=coordinates, lengths=lengths)
+        os.rename(tmp, path)
+
+    def evict(self):
+        '''
+        Remove the least recently used entries until the cache fits in max_bytes.
+        Output: the number of entries removed.
+        '''
+        if self.max_bytes is None:
+            return 0
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith(self.SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.root, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.root, name))
+            except OSError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+    def _path(self, key):
+        '''
+        helper function for get and put.
+        '''
+        return os.path.join(self.root, key + self.SUFFIX)
@@ -0,0 +1,138 @@
+'''
+Local block engine for NMF in Thunder Extraction.
+extraction.NMF.fit needs the whole movie as a thunder Images object, so the
+movie must fit in memory before the block decomposition starts. Here the blocks
+are cut from a (T, H, W) array, typically a memmap, and fitted one at a time:
+only the padded tile of the current block is read into memory, and its regions
+are shifted back to movie coordinates and added to the model as they come.
+For instance,
+    algorithm = NMF(k=5, percentile=99, max_iter=50, overlap=0.1)
+    model = fit_blocks(np.memmap(...), algorithm, chunk_size=(32, 32), padding=(25, 25))
+    merged = merge_regions([region.coordinates for region in model.regions], 0.1)
+gives the same blocks, and the same region coordinates, as
+    model = algorithm.fit(images, chunk_size=(32, 32), padding=(25, 25))
+With n_workers, the tiles of a memmap are scattered to a process pool instead:
+each worker maps the same file and reads its own tile, so the movie is never
+pickled, and the regions are gathered back in block order. The memmap file is
+the shared view, as multiprocessing.shared_memory is not available on Python 3.6.
+With a BlockCache, the unmerged sources of every block are looked up by content
+and parameters before factorizing, and the overlap merge within the block is
+done here, so changing only the overlap or the merge threshold skips NMF.
+'''
+
+import copy
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from extraction.model import ExtractionModel
+
+def block_grid(dims, chunk_size, padding=None):
+    '''
+    Split the FOV into blocks of chunk_size pixels, padded on every side by
+    padding pixels (clipped at the borders), the way thunder's toblocks does.
+    Input: the (H, W) FOV, the block size and the padding.
+    Output: a list of tiles, each a (rows, cols) tuple of slices of the padded block.
+    '''
+    padding = padding or (0, 0)
+    tiles = []
+    for r in range(0, dims[0], chunk_size[0]):
+        for c in range(0, dims[1], chunk_size[1]):
+            tiles.append((slice(max(r - padding[0], 0), min(r + chunk_size[0] + padding[0], dims[0])),
+                          slice(max(c - padding[1], 0), min(c + chunk_size[1] + padding[1], dims[1]))))
+    return tiles
+
+def fit_tile(images, tile, algorithm, cache=None):
+    '''
+    Fit the algorithm on one padded tile of a (T, H, W) array.
+    This calls the per-block routine that algorithm.fit maps over thunder blocks,
+    so a tile without any source simply gives an empty list.
+    With a cache, the sources are factorized without merging, stored, and then
+    merged with merge_sources at the overlap of the algorithm.
+    Output: the regions found, as a list of regional.one in movie coordinates.
+    '''
+    block = np.asarray(images[(slice(None),) + tile])
+    if cache is None:
+        regions = list(algorithm._get(block))
+    else:
+        key = cache.key(block, algorithm)
+        sources = cache.get(key)
+        if sources is None:
+            unmerged = copy.copy(algorithm)
+            unmerged.overlap = None
+            sources = list(unmerged._get(block))
+            cache.put(key, sources)
+        regions = merge_sources(sources, algorithm.overlap)
+    offset = np.array([tile[0].start, tile[1].start])
+    for region in regions:
+        region.coordinates = region.coordinates + offset
+    return regions
+
+def merge_sources(sources, overlap):
+    '''
+    Merge the sources of one block the way extraction.NMF does: repeatedly merge
+    the first pair, in order, whose overlap is above the threshold.
+    Input: a list of regional.one and the overlap threshold (None to skip merging).
+    Output: the merged list.
+    '''
+    sources = list(sources)
+    if overlap is None:
+        return sources
+    pair = _overlapping_pair(sources, overlap)
+    while pair is not None:
+        sources[pair[0]] = sources[pair[0]].merge(sources[pair[1]])
+        del sources[pair[1]]
+        pair = _overlapping_pair(sources, overlap)
+    return sources
+
+def _overlapping_pair(sources, overlap):
+    '''
+    helper function for merge_sources.
+    '''
+    for i1, s1 in enumerate(sources):
+        for i2 in range(i1 + 1, len(sources)):
+            if s1.overlap(sources[i2]) > overlap:
+                return i1, i2
+    return None
+
+def fit_blocks(images, algorithm, chunk_size, padding=None, n_workers=None, cache=None):
+    '''
+    Fit the algorithm block by block, out of core.
+    Memory stays proportional to the padded block size times T (per worker).
+    Input: a (T, H, W) array or memmap, an extraction algorithm (e.g. NMF),
+    the block size, the padding and the number of worker processes; more than
+    one worker requires images to be a np.memmap, and an optional BlockCache.
+    Output: an ExtractionModel holding the regions of all blocks, before merging.
+    '''
+    tiles = block_grid(images.shape[1:], chunk_size, padding)
+    if n_workers is not None and n_workers > 1:
+        if not isinstance(images, np.memmap):
+            raise ValueError('Parallel block fitting needs a np.memmap, got {}'.format(type(images).__name__))
+        source = (images.filename, images.dtype.str, images.shape, images.offset)
+        executor = ProcessPoolExecutor(max_workers=n_workers)
+        results = executor.map(_fit_mapped_tile, [(source, tile, algorithm, cache) for tile in tiles])
+    else:
+        executor = None
+        results = (fit_tile(images, tile, algorithm, cache) for tile in tiles)
+    regions = []
+    try:
+        for i, found in enumerate(results):
+            regions.extend(found)
+            print ('Block {}/{}: {} regions so far'.format(i + 1, len(tiles), len(regions)))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if cache is not None:
+        cache.evict()
+    return ExtractionModel(regions)
+
+_mapped = {}
+
+def _fit_mapped_tile(args):
+    '''
+    helper function for fit_blocks, run in the worker processes.
+    The memmap is opened once per worker and reused for its next tiles.
+    '''
+    source, tile, algorithm, cache = args
+    if source not in _mapped:
+        filename, dtype, shape, offset = source
+        _mapped[source] = np.memmap(filename, mode='r', dtype=dtype, shape=shape, offset=offset)
+    return fit_tile(_mapped[source], tile, algorithm, cache)
@@ -0,0 +1,105 @@
+'''
+Merge of overlapping regions for ThunderNMF, replacing ExtractionModel.merge.
+ExtractionModel.merge compares every region with its k nearest centers, and
+regional's overlap tests pixel membership in Python lists, so merging slows down
+sharply once there are thousands of candidate regions (k times the number of blocks).
+Here:
+    - regions are hashed into a grid by their bounding box, and only regions
+      sharing a cell with overlapping boxes are compared;
+    - the overlap (intersection over union, as regional's 'fraction') is
+      computed on the sorted linear pixel indices of both regions;
+    - pairs over the threshold are joined with union-find, so chains of
+      overlapping regions merge in a single pass.
+The pass is repeated on the merged regions, max_iter times at most, as
+ExtractionModel.merge does.
+    merged = merge_regions([region.coordinates for region in model.regions], 0.1)
+'''
+
+import numpy as np
+
+def merge_regions(regions, overlap, max_iter=2, cell_size=None):
+    '''
+    Merge overlapping regions.
+    Input: a list of (n, 2) arrays of pixel coordinates, the minimal overlap of
+    two regions to be merged, the maximal number of passes and the side of the
+    grid cells in pixels (default: twice the median bounding box side).
+    Output: the merged regions, as a list of (n, 2) arrays of sorted coordinates.
+    '''
+    regions = [np.asarray(region, dtype=np.int64).reshape(-1, 2) for region in regions]
+    regions = [region for region in regions if len(region)]
+    if not regions:
+        return []
+    width = max(region[:, 1].max() for region in regions) + 1
+    pixels = [np.unique(region[:, 0] * width + region[:, 1]) for region in regions]
+    for _ in range(max_iter):
+        merged = _merge_once(pixels, width, overlap, cell_size)
+        if len(merged) == len(pixels):
+            break
+        pixels = merged
+    return [np.stack(np.divmod(p, width), axis=1) for p in pixels]
+
+def candidate_pairs(boxes, cell_size=None):
+    '''
+    Pairs of regions whose bounding boxes intersect, found with a grid hash.
+    Input: an (n, 4) array of boxes (row min, col min, row max, col max), inclusive.
+    Output: an (m, 2) array of pairs (i, j) with i < j.
+    '''
+    if cell_size is None:
+        cell_size = max(1, int(2 * np.median(boxes[:, 2:] - boxes[:, :2] + 1)))
+    grid = {}
+    for i, (r0, c0, r1, c1) in enumerate(boxes // cell_size):
+        for r in range(r0, r1 + 1):
+            for c in range(c0, c1 + 1):
+                grid.setdefault((r, c), []).append(i)
+    pairs = set()
+    for members in grid.values():
+        for a in range(len(members)):
+            for b in range(a + 1, len(members)):
+                pairs.add((members[a], members[b]))
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+    pairs = np.array(sorted(pairs), dtype=np.int64)
+    first, second = boxes[pairs[:, 0]], boxes[pairs[:, 1]]
+    hit = ((first[:, :2] <= second[:, 2:]) & (second[:, :2] <= first[:, 2:])).all(axis=1)
+    return pairs[hit]
+
+def fraction(a, b):
+    '''
+    Intersection over union of two sorted arrays of unique linear indices.
+    '''
+    hit = np.searchsorted(b, a)
+    hit[hit == len(b)] = 0
+    intersection = np.count_nonzero(b[hit] == a)
+    return intersection / float(len(a) + len(b) - intersection)
+
+def _merge_once(pixels, width, overlap, cell_size):
+    '''
+    helper function for merge_regions; one pass of grid hash, overlap and union-find.
+    '''
+    boxes = np.array([[p[0] // width, (p % width).min(), p[-1] // width, (p % width).max()]
+                      for p in pixels], dtype=np.int64)
+    parent = np.arange(len(pixels))
+    for i, j in candidate_pairs(boxes, cell_size):
+        if fraction(pixels[i], pixels[j]) > overlap:
+            ri, rj = _find(parent, i), _find(parent, j)
+            if ri != rj:
+                parent[max(ri, rj)] = min(ri, rj)
+    roots = np.array([_find(parent, i) for i in range(len(pixels))])
+    order = np.argsort(roots, kind='mergesort')
+    starts = np.flatnonzero(np.diff(roots[order])) + 1
+    merged = []
+    for members in np.split(order, starts):
+        if len(members) == 1:
+            merged.append(pixels[members[0]])
+        else:
+            merged.append(np.unique(np.concatenate([pixels[m] for m in members])))
+    return merged
+
+def _find(parent, i):
+    '''
+    helper function for _merge_once; union-find root with path halving.
+    '''
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
@@ -1,34 +1,75 @@
+import os
+import numpy as np
 import thunder as td
 from extraction import NMF
 import ThunderNMF
+from .blocks import fit_blocks
+from .blockcache import BlockCache
+from .merge import merge_regions
+from Common import PredictionWriter, score_submission, print_scores
 
 def main(setName=['00.00', '00.01','01.00','01.01','02.00','02.01','03.00','04.00','04.01'],
             base='caesar', _k=5, _percentile=99, _max_iter=50, _overlap=0.1, _chunk_size=32,
-            _padding=25, _merge=0.1):
+            _padding=25, _merge=0.1, cache=None, sidecar=False, truth=None,
+            out_of_core=False, n_workers=None, block_cache=None, block_cache_size=1024):
     '''
     Main method for NMF approach. This is a wrapper built upon the original pipeline of NMF in Thunder Extraction.
     The code for putting data into json files is from:
     https://gist.github.com/freeman-lab/330183fdb0ea7f4103deddc9fae18113
+    If cache names a folder, the movies are kept there as memmaps and shared with
+    the UNET and CNMF entry points, so they are decoded only once.
+    The submission is streamed to disk one dataset at a time; with sidecar, the
+    run-length encoded masks are also written to submission.npz for the scorer.
+    If truth names a ground-truth file, the submission is scored once written.
+    With out_of_core, the movie and its median filtered version stay memory mapped
+    (the movie cache defaults to movie_cache/) and NMF is fitted block by block,
+    so memory is bounded by the padded block size times the number of frames.
+    With n_workers > 1, the blocks of the memory mapped filtered movie are fitted
+    by a local process pool instead of one after another (no Spark needed); the
+    regions are gathered and merged in this process.
+    If block_cache names a folder, the per-block NMF results are kept there (up to
+    block_cache_size MB, least recently used first out), so a rerun with another
+    _overlap or _merge only redoes the merges.
+    Regions across blocks are merged with ThunderNMF.merge (grid hash and
+    union-find) rather than ExtractionModel.merge, which compares all neighbours.
     '''
-    submission = []
-    for data in setName:
-        images = ThunderNMF.load(setName, base)
-        images = ThunderNMF.grayScale(images)
-        print ('The shape of each training image after preprocessing is {}'.format(images[1].shape))
-        print ('Applying median filter for {}.test'.format(data))
-        images = ThunderNMF.medianFilter(images)
-        print ('Applying NMF for {}.test.....'.format(data))
-        algorithm = NMF(k=_k, percentile=_percentile, max_iter=_max_iter, overlap=_overlap)
-        model = algorithm.fit(images, chunk_size=(_chunk_size,_chunk_size), padding=(_padding,_padding))
-        print ('Merge regions for {}.test....'.format(data))
-        merged = model.merge(_merge)
-        regions = [{'coordinates': region.coordinates.tolist()} for region in merged.regions]
-        result = {'dataset': '{}.test'.format(data), 'regions': regions}
-        submission.append(result)
+    if out_of_core and not cache:
+        cache = 'movie_cache'
+    blockwise = out_of_core or (n_workers is not None and n_workers > 1) or bool(block_cache)
+    blocks = BlockCache(block_cache, max_bytes=block_cache_size * 2 ** 20) if block_cache else None
+    with PredictionWriter('submission.json', sidecar='submission.npz' if sidecar else None) as writer:
+        for data in setName:
+            images = ThunderNMF.load(data, base, cache=cache)
+            images = ThunderNMF.grayScale(images)
+            dims = images[0].shape
+            print ('The shape of each training image after preprocessing is {}'.format(dims))
+            algorithm = NMF(k=_k, percentile=_percentile, max_iter=_max_iter, overlap=_overlap)
+            print ('Applying median filter for {}.test'.format(data))
+            if blockwise:
+                # next to the cached movie, if any; removed even if the fit fails
+                filtered = os.path.join(cache or '.', '{}.test.filtered.mmap'.format(data))
+                try:
+                    images = ThunderNMF.medianFilter(images, out=np.memmap(filtered, mode='w+', dtype=np.uint8,
+                                                                           shape=images.shape))
+                    print ('Applying NMF for {}.test.....'.format(data))
+                    model = fit_blocks(images, algorithm, chunk_size=(_chunk_size,_chunk_size), padding=(_padding,_padding),
+                                       n_workers=n_workers, cache=blocks)
+                finally:
+                    images = None
+                    if os.path.exists(filtered):
+                        os.remove(filtered)
+            else:
+                images = ThunderNMF.medianFilter(images)
+                print ('Applying NMF for {}.test.....'.format(data))
+                model = algorithm.fit(images, chunk_size=(_chunk_size,_chunk_size), padding=(_padding,_padding))
+            print ('Merge regions for {}.test....'.format(data))
+            regions = merge_regions([region.coordinates for region in model.regions], _merge)
+            writer.write('{}.test'.format(data), regions, dims=dims)
 
-        # show a message for processing
-        print ('Completed processing results for {}.test'.format(data))
+            # show a message for processing
+            print ('Completed processing results for {}.test'.format(data))
 
-    with open('{}.json'.format('submission'), 'w') as f:
-        f.write(json.dumps(submission))
+    if truth:
+        print ('Scoring the submission against {}'.format(truth))
+        print_scores(score_submission(truth, 'submission.npz' if sidecar else 'submission.json'))
     print ('Done!')
@@ -0,0 +1,143 @@
+'''
+Hyperparameter sweep for NMF in Thunder Extraction.
+Every dataset is loaded and median filtered once, into a memmap, and every
+configuration of the grid is then fitted on it by a pool of worker processes.
+Configurations differing only in _merge share their block fits: each worker
+fits the blocks once and merges the regions for every _merge value.
+The results table (sweep.csv) has one row per configuration and dataset, plus a
+'mean' row per configuration, with the number of regions, the fit and merge
+times in seconds and, when the ground truth is given, the neurofinder scores.
+For instance,
+    python -m ThunderNMF sweep --_k 5 10 --_merge 0.1 0.2 --truth regions.json
+'''
+
+import os
+import csv
+import time
+import itertools
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from extraction import NMF
+import ThunderNMF
+from .blocks import fit_blocks
+from .blockcache import BlockCache
+from .merge import merge_regions
+from Common.scoring import KEYS, score, load_pixels, region_pixels
+
+FIT_PARAMS = ['_k', '_percentile', '_max_iter', '_overlap', '_chunk_size', '_padding']
+COLUMNS = ['dataset'] + FIT_PARAMS + ['_merge', 'regions', 'fit_seconds', 'merge_seconds'] + KEYS
+
+def main(setName=['00.00', '00.01','01.00','01.01','02.00','02.01','03.00','04.00','04.01'],
+            base='caesar', _k=[5], _percentile=[99], _max_iter=[50], _overlap=[0.1], _chunk_size=[32],
+            _padding=[25], _merge=[0.1], cache=None, truth=None, n_workers=None, block_cache=None,
+            results='sweep.csv'):
+    '''
+    Run NMF for every combination of the given parameter values.
+    Input: the datasets, the base location, a list of values for each of the seven
+    parameters of ThunderNMF.nmf.main, the movie cache folder, the ground-truth
+    regions (.json, optional), the number of worker processes [Default: number of
+    cores], the block cache folder (optional) and the path of the results table.
+    Output: the rows of the results table, as a list of dicts.
+    '''
+    grid = [OrderedDict(zip(FIT_PARAMS, values)) for values in
+            itertools.product(_k, _percentile, _max_iter, _overlap, _chunk_size, _padding)]
+    print ('Sweeping {} configurations over {} datasets'.format(len(grid) * len(_merge), len(setName)))
+    truths = load_pixels(truth) if truth else {}
+
+    movies = OrderedDict()
+    try:
+        for data in setName:
+            movies[data] = _filtered(data, base, cache)
+        jobs = []
+        for data, (filename, shape) in movies.items():
+            name = '{}.test'.format(data)
+            expected = truths.get(name, truths.get(None) if len(movies) == 1 else None)
+            for params in grid:
+                jobs.append((name, filename, shape, params, _merge, expected, block_cache))
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            rows = [row for found in executor.map(_run, jobs) for row in found]
+        if block_cache:
+            # only once the workers are done, so none loses a block it is reading
+            BlockCache(block_cache).evict()
+    finally:
+        for filename, _ in movies.values():
+            os.remove(filename)
+
+    rows.extend(_means(rows))
+    with open(results, 'w') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    print_table(rows)
+    print ('Results written to {}'.format(results))
+    return rows
+
+def print_table(rows):
+    '''
+    Print the results table, one configuration per line.
+    '''
+    print (' '.join('{:>13}'.format(column) for column in COLUMNS))
+    for row in rows:
+        print (' '.join('{:>13.4g}'.format(row[column]) if isinstance(row.get(column), float)
+                        else '{:>13}'.format(row.get(column, '')) for column in COLUMNS))
+
+def _filtered(data, base, cache):
+    '''
+    helper function for main; loads and median filters a dataset into a memmap,
+    next to the cached movie if any.
+    Output: the memmap file name and the (T, H, W) shape.
+    '''
+    images = ThunderNMF.load(data, base, cache=cache)
+    images = ThunderNMF.grayScale(images)
+    print ('Applying median filter for {}.test'.format(data))
+    filename = os.path.join(cache or '.', '{}.test.filtered.mmap'.format(data))
+    ThunderNMF.medianFilter(images, out=np.memmap(filename, mode='w+', dtype=np.uint8, shape=images.shape))
+    return filename, images.shape
+
+def _run(args):
+    '''
+    helper function for main, run in the worker processes: fits the blocks of one
+    dataset for one configuration, then merges and scores for every _merge value.
+    '''
+    name, filename, shape, params, merges, expected, block_cache = args
+    images = np.memmap(filename, mode='r', dtype=np.uint8, shape=shape)
+    algorithm = NMF(k=params['_k'], percentile=params['_percentile'], max_iter=params['_max_iter'],
+                    overlap=params['_overlap'])
+    cache = BlockCache(block_cache, max_bytes=None) if block_cache else None
+    start = time.time()
+    model = fit_blocks(images, algorithm, chunk_size=(params['_chunk_size'],) * 2,
+                       padding=(params['_padding'],) * 2, cache=cache)
+    fit_seconds = time.time() - start
+    candidates = [region.coordinates for region in model.regions]
+
+    rows = []
+    for merge in merges:
+        start = time.time()
+        regions = merge_regions(candidates, merge)
+        row = OrderedDict([('dataset', name)])
+        row.update(params)
+        row.update([('_merge', merge), ('regions', len(regions)), ('fit_seconds', fit_seconds),
+                    ('merge_seconds', time.time() - start)])
+        if expected is not None:
+            row.update(score(expected, region_pixels(regions)))
+        print ('{}: {}'.format(name, ', '.join('{}={}'.format(k, v) for k, v in row.items() if k != 'dataset')))
+        rows.append(row)
+    return rows
+
+def _means(rows):
+    '''
+    helper function for main; averages the rows of each configuration over the datasets.
+    '''
+    configurations = OrderedDict()
+    for row in rows:
+        configurations.setdefault(tuple(row[p] for p in FIT_PARAMS + ['_merge']), []).append(row)
+    means = []
+    for key, group in configurations.items():
+        mean = OrderedDict([('dataset', 'mean')])
+        mean.update(zip(FIT_PARAMS + ['_merge'], key))
+        for column in ['regions', 'fit_seconds', 'merge_seconds'] + KEYS:
+            if column in group[0]:
+                mean[column] = float(np.mean([row[column] for row in group]))
+        means.append(mean)
+    return means
@@ -1,3 +1,7 @@
 from .preprocess import load, grayScale, medianFilter
 from . import unet
 from . import preprocess
+from . import tiling
+from . import predictor
+from . import provider
+from . import postprocess
@@ -21,7 +21,7 @@ def info():
     print (tf.test.gpu_device_name())
 
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(
         description='Neuron Segmentation',
         argument_default=argparse.SUPPRESS
@@ -32,18 +32,45 @@ def main():
     op = options.add_parser('info', description='print system info')
     op.set_defaults(func=info)
 
+    # Prediction with a trained Unet
+    op = options.add_parser('predict', description='predict neurofinder test folders with one restore of the checkpoint',
+                            argument_default=argparse.SUPPRESS)
+    op.add_argument('testPaths', nargs='+', help='the neurofinder test folders')
+    op.add_argument('--model', help='the trained checkpoint; default ./unet_trained/model.cpkt')
+    op.add_argument('--layerNum', type=int, help='the number of layers of the trained Unet')
+    op.add_argument('--features', type=int, help='the number of features of the trained Unet')
+    op.add_argument('--batch', type=int, help='number of datasets (or tiles, with --tile) predicted at a time; default 4')
+    op.add_argument('--tile', type=int, help='predict tile by tile with tiles of this size (bounded memory)')
+    op.add_argument('--stitch', choices=['cosine', 'crop'], help='how tiles are stitched back; default cosine')
+    op.add_argument('--cache', help='folder of the movie cache shared by all modules')
+    op.add_argument('--output', help='folder of the predicted probability maps; default prediction')
+    op.add_argument('--sidecar', action='store_true', help='also write run-length encoded masks to submission.npz')
+    op.add_argument('--channels', nargs='+', choices=['sum', 'mean', 'max', 'std', 'correlation'],
+                    help='summary images stacked as the input channels, computed in one pass; default sum')
+    op.add_argument('--threshold', type=float, help='probability above which a pixel belongs to a cell; default 0.5')
+    op.add_argument('--min_size', type=int, help='smallest cell kept, in pixels; default 20')
+    op.add_argument('--max_size', type=int, help='largest cell kept, in pixels; default none')
+    op.add_argument('--min_distance', type=int, help='min distance between the centers of touching cells split apart; default 3')
+    op.set_defaults(func=UNET.predictor.main)
+
     # UNET
     parser.add_argument('--trainPath', help='the folder of training images')
     parser.add_argument('--testPath', help='the folder of testing images')
-    parser.add_argument('--layerNum', help='the number of layers in the Unet. Suggested 3, 4, or 5')
-    parser.add_argument('--features', help='the number of features in the Unet')
-    parser.add_argument('--bsize', help='training batch size; suggested 2 or 4')
+    parser.add_argument('--layerNum', type=int, help='the number of layers in the Unet. Suggested 3, 4, or 5')
+    parser.add_argument('--features', type=int, help='the number of features in the Unet')
+    parser.add_argument('--bsize', type=int, help='training batch size; suggested 2 or 4')
     parser.add_argument('--opm', help='optimizer in Unet; default adam; alternatively you can use momentum')
-    parser.add_argument('--iter', help='training iterations in one epoch of all data')
-    parser.add_argument('--ep', help='the number of epoches in training')
-    parser.add_argument('--display', help='the number of steps per display')
+    parser.add_argument('--iter', type=int, help='training iterations in one epoch of all data')
+    parser.add_argument('--ep', type=int, help='the number of epoches in training')
+    parser.add_argument('--display', type=int, help='the number of steps per display')
+    parser.add_argument('--cache', help='folder of the movie cache shared by all modules; frames are decoded only once')
+    parser.add_argument('--tile', type=int, help='predict tile by tile with tiles of this size (bounded memory)')
+    parser.add_argument('--batch', type=int, help='number of tiles per prediction batch; default 4')
+    parser.add_argument('--stitch', choices=['cosine', 'crop'], help='how tiles are stitched back; default cosine')
+    parser.add_argument('--workers', type=int, help='threads prefetching random training crops from a memmap of the decoded images')
+    parser.add_argument('--crop', type=int, help='size of the random training crops, with --workers')
     parser.set_defaults(func=UNET.unet.main)
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if hasattr(args, 'func'):
         args = vars(args)
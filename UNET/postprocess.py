@@ -0,0 +1,68 @@
+'''
+Post-processing of the Unet output: from a probability map to neurofinder regions.
+The map is thresholded, touching cells are split by a watershed on the distance
+transform of the mask (one marker per local maximum of the distance, at least
+min_distance pixels apart), and components outside [min_size, max_size] pixels
+are dropped. Everything is done with whole-array operations:
+    labels = segment(probability, threshold=0.5, min_size=20)
+    regions = label_regions(labels)
+    save_labels('00.00.test.npz', probability, labels)
+regions is a list of (n, 2) coordinate arrays, ready for Common.PredictionWriter.
+'''
+
+import numpy as np
+import scipy.ndimage as ndimg
+try:
+    from skimage.segmentation import watershed
+except ImportError:
+    from skimage.morphology import watershed
+
+def segment(probability, threshold=0.5, min_size=20, max_size=None, min_distance=3, split=True):
+    '''
+    Label the cells of a probability map.
+    Input: the (H, W) probability map, the probability threshold, the minimal and
+    maximal sizes of a cell in pixels, the minimal distance between the centers of
+    two touching cells, and whether to split touching cells at all.
+    Output: an (H, W) int32 label image, cells numbered from 1, background 0.
+    '''
+    mask = np.asarray(probability) > threshold
+    if split:
+        distance = ndimg.distance_transform_edt(mask)
+        peaks = (ndimg.maximum_filter(distance, size=2 * min_distance + 1) == distance) & mask
+        markers, _ = ndimg.label(peaks)
+        labels = watershed(-distance, markers, mask=mask)
+    else:
+        labels, _ = ndimg.label(mask)
+    return filter_sizes(labels, min_size, max_size)
+
+def filter_sizes(labels, min_size=20, max_size=None):
+    '''
+    Drop the labels outside [min_size, max_size] pixels and number the others from 1.
+    Output: the relabelled int32 image.
+    '''
+    counts = np.bincount(labels.ravel())
+    keep = counts >= min_size
+    if max_size is not None:
+        keep &= counts <= max_size
+    keep[0] = False
+    lookup = np.zeros(len(counts), dtype=np.int32)
+    lookup[keep] = np.arange(1, np.count_nonzero(keep) + 1)
+    return lookup[labels]
+
+def label_regions(labels):
+    '''
+    Regions of a label image, in label order.
+    Output: a list of (n, 2) arrays of [row, col] coordinates.
+    '''
+    coordinates = np.argwhere(labels)
+    values = labels[labels > 0]
+    order = np.argsort(values, kind='mergesort')
+    counts = np.bincount(values, minlength=labels.max() + 1)[1:]
+    regions = np.split(coordinates[order], np.cumsum(counts)[:-1]) if len(counts) else []
+    return [region for region in regions if len(region)]
+
+def save_labels(path, probability, labels):
+    '''
+    Save a probability map and its labels to one compressed .npz.
+    '''
+    np.savez_compressed(path, probability=np.asarray(probability, dtype=np.float32), labels=labels)
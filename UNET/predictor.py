@@ -0,0 +1,155 @@
+'''
+Prediction service for a trained Unet.
+net.predict restores the checkpoint from disk on every call. The Predictor
+restores it once into a session kept open, so any number of images, or of
+neurofinder datasets, costs a single restore. For instance,
+    with Predictor('./unet_trained/model.cpkt', layers=4, features=64) as predictor:
+        predictions = predictor.predict([image1, image2])
+main runs the predictor over a list of neurofinder test folders: the summary
+images are built and predicted batch datasets at a time, and each dataset gets
+its probability map and cell labels in prediction/{name}.npz and its regions,
+from UNET.postprocess, in submission.json.
+The network input is any stack of the summary images of Common.summary (the sum
+of the frames by default), all computed in one streaming read of the movie.
+'''
+
+import os
+import numpy as np
+import tensorflow as tf
+from tf_unet import unet
+from Common import list_frames, iter_frames, MovieCache, PredictionWriter, SummaryImages
+from .tiling import predict_tiled
+from .postprocess import segment, label_regions, save_labels
+
+class Predictor(object):
+    '''
+    A Unet with its checkpoint restored in an open session.
+    '''
+
+    def __init__(self, model_path, net=None, layers=4, features=64, channels=1, n_class=2):
+        '''
+        Input: the checkpoint, the Unet (optional; built from layers, features,
+        channels and n_class otherwise, which resets the default graph) and its
+        number of layers, needed for tiled inference.
+        '''
+        self.net = net if net is not None else unet.Unet(channels=channels, n_class=n_class,
+                                                         layers=layers, features_root=features)
+        self.layers = layers
+        self.sess = tf.Session()
+        self.sess.run(tf.global_variables_initializer())
+        self.net.restore(self.sess, model_path)
+        self._predict = session_predictor(self.sess, self.net)
+
+    def predict(self, images, batch_size=4, tile=None, stitch='cosine'):
+        '''
+        Predict a list of images, of any shapes.
+        Without tile, images of the same shape are stacked batch_size at a time and
+        predicted in one pass each; the border lost to the receptive field is
+        padded with zeros so the prediction lines up with the image. With tile,
+        every image is predicted tile by tile (see UNET.tiling), batch_size tiles at a time.
+        Input: a list of (H, W) or (H, W, channels) images.
+        Output: the list of (H, W, n_class) predictions, in the same order.
+        '''
+        images = [np.asarray(image, dtype=np.float32) for image in images]
+        images = [image[..., np.newaxis] if image.ndim == 2 else image for image in images]
+        if tile:
+            return [predict_tiled(self._predict, image, self.layers, tile_size=tile, batch_size=batch_size,
+                                  stitch=stitch) for image in images]
+        predictions = [None] * len(images)
+        shapes = {}
+        for i, image in enumerate(images):
+            shapes.setdefault(image.shape, []).append(i)
+        for indices in shapes.values():
+            for start in range(0, len(indices), batch_size):
+                batch = indices[start:start + batch_size]
+                for i, prediction in zip(batch, self._predict(np.stack([images[i] for i in batch]))):
+                    rows, cols = (np.array(images[i].shape[:2]) - prediction.shape[:2]) // 2
+                    predictions[i] = np.pad(prediction, ((rows, images[i].shape[0] - prediction.shape[0] - rows),
+                                                         (cols, images[i].shape[1] - prediction.shape[1] - cols),
+                                                         (0, 0)), mode='constant')
+        return predictions
+
+    def close(self):
+        self.sess.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def session_predictor(sess, net):
+    '''
+    Prediction function running the network in an open session, where the checkpoint
+    has already been restored; unlike net.predict, nothing is reloaded between calls.
+    Input: the session and the Unet.
+    Output: a function mapping a (n, h, w, channels) batch to its (n, h', w', n_class) prediction.
+    '''
+    def predict(batch):
+        y_dummy = np.empty(batch.shape[:3] + (net.n_class,))
+        return sess.run(net.predicter, feed_dict={net.x: batch, net.y: y_dummy, net.keep_prob: 1.})
+    return predict
+
+def summary_image(testPath, cache=None, channels=['sum'], chunk_size=200):
+    '''
+    The network input of a neurofinder test folder, built in one pass over its
+    frames with bounded memory.
+    Input: the folder (holding images/*.tiff), the movie cache folder (optional),
+    the summary images to stack (among sum, mean, max, std and correlation) and
+    the number of frames read at a time.
+    Output: the (H, W, len(channels)) image.
+    '''
+    files = list_frames(os.path.join(testPath, 'images'))
+    if cache:
+        movie = MovieCache(cache).get(dataset_name(testPath), files).movie()
+        chunks = (movie[start:start + chunk_size] for start in range(0, len(movie), chunk_size))
+    else:
+        chunks = iter_frames(files, chunk_size=chunk_size)
+    summary = SummaryImages(channels)
+    for chunk in chunks:
+        summary.update(chunk)
+    return summary.stack(channels)
+
+def dataset_name(testPath):
+    '''
+    Name of a dataset from its folder, e.g. 00.00.test for .../neurofinder.00.00.test/.
+    '''
+    return os.path.basename(testPath.rstrip('/')).replace('neurofinder.', '')
+
+def main(testPaths, model='./unet_trained/model.cpkt', layerNum=4, features=64, batch=4, tile=None,
+         stitch='cosine', cache=None, output='prediction', sidecar=False, channels=['sum'],
+         threshold=0.5, min_size=20, max_size=None, min_distance=3):
+    '''
+    Predict a list of neurofinder test folders with one restore of the checkpoint.
+    Input:
+    testPaths: The neurofinder test folders.
+    model: The checkpoint of the trained Unet.
+    layerNum, features: The architecture of the trained Unet.
+    batch: Number of datasets (or of tiles, with tile) predicted at a time.
+    tile: Size of the tiles for tiled inference (optional).
+    stitch: How the tiles are put back together, 'cosine' or 'crop'.
+    cache: The folder of the movie cache shared with the other modules (optional).
+    output: The folder of the predicted probability maps and labels, one .npz per dataset.
+    sidecar: Also write the run-length encoded masks to submission.npz.
+    channels: The summary images stacked as the input channels; the Unet must have
+    been trained on the same stack.
+    threshold, min_size, max_size, min_distance: The post-processing of the probability
+    maps into cells (see UNET.postprocess.segment).
+    '''
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    with Predictor(model, layers=layerNum, features=features, channels=len(channels)) as predictor, \
+            PredictionWriter('submission.json', sidecar='submission.npz' if sidecar else None) as writer:
+        for start in range(0, len(testPaths), batch):
+            paths = testPaths[start:start + batch]
+            images = [summary_image(path, cache, channels) for path in paths]
+            predictions = predictor.predict(images, batch_size=batch, tile=tile, stitch=stitch)
+            for path, prediction in zip(paths, predictions):
+                name = dataset_name(path)
+                probability = prediction[..., 1]
+                labels = segment(probability, threshold=threshold, min_size=min_size, max_size=max_size,
+                                 min_distance=min_distance)
+                save_labels(os.path.join(output, '{}.npz'.format(name)), probability, labels)
+                writer.write(name, label_regions(labels), dims=probability.shape)
+                print('Predicted {}: {} cells in {}'.format(name, labels.max(), probability.shape))
+    print('Done!')
@@ -3,6 +3,12 @@ This file includes preprocessing calls for the images.
 This preprocessing file provides the functions of loading and transforming
 image globs. Say, to load an image glob on Caesar server, just call:
     images = load('01.01', 'caesar')
+which returns all frames as one (T, H, W) uint16 array. To walk through a large
+dataset with bounded memory, ask for a generator of chunks instead:
+    for chunk in load('01.01', 'caesar', chunk_size=500):
+        ...
+Passing cache='movie_cache' decodes the frames only once: the movie is stored in
+the shared memmap cache (see Common.moviecache) and memory mapped on later calls.
 To preprocess the images, we can just apply the functions on the loaded image glob:
 For instance,
     images = grayScale(images)
@@ -15,54 +21,73 @@ import numpy as np
 from glob import glob
 import skimage
 import scipy.ndimage as ndimg
-import skimage.filters as filters
-import skimage.morphology as morphology
+from Common import list_frames, read_frames, iter_frames, MovieCache
+from Common.filters import binary_median
 
-def load(setName, base):
+def load(setName, base, chunk_size=None, n_workers=None, cache=None):
     '''
     Reading all images from a file directory. argument neuroset indicates the name
     of the dataset. For instance, 00.00, 00.01, 02.00, etc.
-    Return a matrix instantiating all images
+    The frames are read in temporal order by a pool of threads, straight into
+    one preallocated single-channel array.
+    Input: the dataset name, the base location, the number of frames per chunk
+    (optional; return a generator of chunks instead of the whole movie), the
+    number of reading threads [Default: number of cores] and the folder of the
+    movie cache (optional; return a read-only memmap of the cached movie).
+    Return a (T, H, W) uint16 matrix instantiating all images,
+    or a generator of (n, H, W) chunks if chunk_size is given.
     '''
     # get the full name of the path;
     if base == 'local':
         dirname = "/Users/yuanmingshi/downloads/johnson/neurofinder.01.01/images/"
     else:
         dirname = '/media/data2TB/jeremyshi/neurofinder.{}.test/images/'.format(setName)
-    # load images using opencv
-    images = [cv2.imread(file) for file in glob('{}*.tiff'.format(dirname))]
-    print ('The number of images is {}'.format(len(images)))
-    return images
+    files = list_frames(dirname)
+    print ('The number of images is {}'.format(len(files)))
+    if cache:
+        images = MovieCache(cache).get('{}.test'.format(setName), files, n_workers=n_workers).movie()
+        if chunk_size:
+            return (images[start:start + chunk_size] for start in range(0, len(images), chunk_size))
+        return images
+    if chunk_size:
+        return iter_frames(files, chunk_size=chunk_size, n_workers=n_workers)
+    return read_frames(files, n_workers=n_workers)
 
 def grayScale(images):
     '''
     Change the images to grayscale
     Input: an array of image arrays.
     Output: an array of image arrays in gray scale.
+    Frames returned by load are already single-channel and are returned as is.
+    A generator of chunks (load with chunk_size) gives a generator converting
+    each chunk as it comes.
     '''
+    if not hasattr(images, '__getitem__'):
+        return (grayScale(chunk) for chunk in images)
+    if len(images) == 0 or np.ndim(images[0]) == 2:
+        return images
     images = [cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) for image in images]  # convert to greyscale
     return images
 
-def medianFilter(images):
+def medianFilter(images, chunk_size=100, n_processes=None, out=None):
     '''
-    Add a median filter into a image using _median filters_ and _morphology_ in skimage.
-    There's a helper function for it because we need to apply the filter on every img.
-    Input: an array of image arrays.
-    Output: an array of image arrays after the median filter.
+    Add a median filter into the images, the same way as skimage's _median filters_
+    with a _morphology_ square footprint. Every frame is binarized at its own median and filtered with a square(3)
+    footprint. The whole stack is processed at once, in chunks of frames spread
+    over a pool of processes, see Common.filters.binary_median.
+    Input: an array of image arrays, the number of frames per chunk, the number of
+    processes [Default: number of cores] and an optional (T, H, W) output array.
+    Output: a (T, H, W) uint8 array of images after the median filter.
+    A generator of chunks (load with chunk_size) gives a generator filtering
+    each chunk as it comes; out is then not supported.
     The method is adopted from:
     https://github.com/eds-uga/cbio4835-sp17/blob/master/lectures/Lecture23.ipynb
     '''
-    images = [_median(image) for image in images]
-    return images
-
-def _median(img):
-    '''
-    helper function for medianFilter method.
-    Input: an image.
-    Output: an image after the median filter.
-    '''
-    # i is the result of only keeping the values higher than the mean in the image
-    i = img > np.median(img)
+    if not hasattr(images, '__getitem__'):
+        if out is not None:
+            raise ValueError('out needs the whole stack, not a generator of chunks')
+        return (medianFilter(chunk, chunk_size=chunk_size, n_processes=n_processes) for chunk in images)
     # Morphology has options on different shapes and values. In practice, square(3) or square(4) perform well.
-    bin_median = filters.median(i, morphology.square(3))
-    return bin_median
+    images = binary_median(np.asarray(images), size=3, chunk_size=chunk_size,
+                           n_processes=n_processes, out=out)
+    return images
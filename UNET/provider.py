@@ -0,0 +1,184 @@
+'''
+Prefetching data provider for training the Unet.
+tf_unet's ImageDataProvider opens and decodes a .tif image and its _mask.tif at
+every training step, so the network waits on the disk between batches. Here the
+images are decoded and normalized once (as ImageDataProvider does: absolute
+value, minus the minimum, over the maximum) into a memmap, and background
+threads cut random crops, flipped at random, into a bounded queue. A call only
+stacks samples that are already waiting:
+    provider = PrefetchDataProvider('traindata/*.tif', crop_size=256, n_workers=2)
+    trainer.train(provider, './unet_trained', ...)
+    provider.report()
+    provider.close()
+The provider records the time training spends waiting on it and the time spent
+between calls (computing), so a starved training loop shows up in report().
+'''
+
+from __future__ import division
+import os
+import glob
+import time
+import shutil
+import tempfile
+import threading
+import numpy as np
+from PIL import Image
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class PrefetchDataProvider(object):
+    '''
+    Drop-in replacement for tf_unet's ImageDataProvider: calling it with n
+    returns a batch (X, Y) of n images (n, h, w, 1) and one-hot labels (n, h, w, 2).
+    '''
+    channels = 1
+    n_class = 2
+
+    def __init__(self, search_path, crop_size=None, n_workers=2, prefetch=32, cache_dir=None,
+                 data_suffix='.tif', mask_suffix='_mask.tif', seed=None):
+        '''
+        Input: the glob of the training images, the size of the random square crops
+        (optional; whole images otherwise, which must then share one shape), the
+        number of threads preparing samples, the number of samples kept ready, the
+        folder of the decoded memmaps [Default: a temporary folder, removed by
+        close], the suffixes of images and masks and the seed of the random crops.
+        '''
+        files = sorted(f for f in glob.glob(search_path) if not f.endswith(mask_suffix))
+        if not files:
+            raise IOError('No training images match {}'.format(search_path))
+        self.crop_size = crop_size
+        self._temporary = cache_dir is None
+        self.cache_dir = tempfile.mkdtemp(prefix='unet_train_') if cache_dir is None else cache_dir
+        try:
+            self.images, self.masks, self.shapes = _decode(files, data_suffix, mask_suffix, self.cache_dir)
+            if crop_size is None and len(set(self.shapes)) > 1:
+                raise ValueError('Training images of different shapes need a crop_size')
+            if crop_size is not None and min(min(shape) for shape in self.shapes) < crop_size:
+                raise ValueError('crop_size {} is larger than the smallest training image'.format(crop_size))
+        except Exception:
+            if self._temporary:
+                shutil.rmtree(self.cache_dir, ignore_errors=True)
+            raise
+        self.offsets = np.concatenate([[0], np.cumsum([h * w for h, w in self.shapes])])
+
+        self.wait_seconds = 0.
+        self.compute_seconds = 0.
+        self.batches = 0
+        self._last = None
+        self._queue = queue.Queue(maxsize=prefetch)
+        self._stop = threading.Event()
+        seed = np.random.randint(2 ** 31) if seed is None else seed
+        self._workers = [threading.Thread(target=self._work, args=(np.random.RandomState(seed + i),))
+                         for i in range(n_workers)]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+
+    def __call__(self, n):
+        '''
+        Output: a batch (X, Y) of n samples.
+        '''
+        start = time.time()
+        if self._last is not None:
+            self.compute_seconds += start - self._last
+        samples = [self._queue.get() for _ in range(n)]
+        self._last = time.time()
+        self.wait_seconds += self._last - start
+        self.batches += 1
+        X = np.stack([sample[0] for sample in samples])[..., np.newaxis]
+        label = np.stack([sample[1] for sample in samples])
+        Y = np.stack([~label, label], axis=-1).astype(np.float32)
+        return X, Y
+
+    def sample(self, random):
+        '''
+        One training sample: a random image, randomly cropped and flipped.
+        Output: the (h, w) float32 image and its (h, w) boolean mask.
+        '''
+        i = random.randint(len(self.shapes))
+        height, width = self.shapes[i]
+        image = self.images[self.offsets[i]:self.offsets[i + 1]].reshape(height, width)
+        mask = self.masks[self.offsets[i]:self.offsets[i + 1]].reshape(height, width)
+        if self.crop_size is not None:
+            r = random.randint(height - self.crop_size + 1)
+            c = random.randint(width - self.crop_size + 1)
+            image = image[r:r + self.crop_size, c:c + self.crop_size]
+            mask = mask[r:r + self.crop_size, c:c + self.crop_size]
+        if random.rand() < 0.5:
+            image, mask = image[::-1], mask[::-1]
+        if random.rand() < 0.5:
+            image, mask = image[:, ::-1], mask[:, ::-1]
+        return np.array(image), np.array(mask, dtype=bool)
+
+    def stats(self):
+        '''
+        Output: a dict of the number of batches served, the seconds spent waiting for
+        data and computing between calls, and the fraction of time spent waiting.
+        '''
+        total = self.wait_seconds + self.compute_seconds
+        return {'batches': self.batches, 'wait_seconds': self.wait_seconds,
+                'compute_seconds': self.compute_seconds,
+                'wait_fraction': self.wait_seconds / total if total else 0.}
+
+    def report(self):
+        '''
+        Print the time spent waiting on data versus computing.
+        '''
+        stats = self.stats()
+        print('Data provider: {} batches, {:.1f}s waiting for data, {:.1f}s computing ({:.1%} waiting)'.format(
+            stats['batches'], stats['wait_seconds'], stats['compute_seconds'], stats['wait_fraction']))
+
+    def close(self):
+        '''
+        Stop the workers, and remove the memmaps if they are temporary.
+        '''
+        self._stop.set()
+        for worker in self._workers:
+            worker.join()
+        self.images = self.masks = None
+        if self._temporary:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _work(self, random):
+        '''
+        helper function for the worker threads; keeps the queue full.
+        '''
+        while not self._stop.is_set():
+            sample = self.sample(random)
+            while not self._stop.is_set():
+                try:
+                    self._queue.put(sample, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+def _decode(files, data_suffix, mask_suffix, cache_dir):
+    '''
+    helper function for PrefetchDataProvider; decodes and normalizes every image and
+    mask once into two flat memmaps, images after images.
+    Output: the float32 images memmap, the boolean masks memmap and the list of shapes.
+    '''
+    shapes = []
+    for f in files:
+        width, height = Image.open(f).size
+        shapes.append((height, width))
+    total = sum(h * w for h, w in shapes)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    images = np.memmap(os.path.join(cache_dir, 'images.mmap'), mode='w+', dtype=np.float32, shape=(total,))
+    masks = np.memmap(os.path.join(cache_dir, 'masks.mmap'), mode='w+', dtype=np.bool_, shape=(total,))
+    offset = 0
+    for f, (height, width) in zip(files, shapes):
+        image = np.abs(np.array(Image.open(f), dtype=np.float32))
+        image -= image.min()
+        if image.max() != 0:
+            image /= image.max()
+        mask = np.array(Image.open(f.replace(data_suffix, mask_suffix)), dtype=np.bool_)
+        images[offset:offset + height * width] = image.ravel()
+        masks[offset:offset + height * width] = mask.ravel()
+        offset += height * width
+    images.flush()
+    masks.flush()
+    return images, masks, shapes
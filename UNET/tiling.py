@@ -0,0 +1,102 @@
+'''
+Tiled sliding-window inference for the U-Net of tf_unet.
+The U-Net uses valid convolutions: a tile of size n gives a prediction of size
+output_size(n) < n for its center only, the rest being the receptive field.
+So the image is padded by reflection, cut into overlapping tiles whose centers
+cover the FOV, the tiles are sent through the network batch_size at a time, and
+the centers are stitched back, either cropped edge to edge ('crop') or blended
+with a cosine window over the overlaps ('cosine'). Peak memory depends on the
+tile and batch sizes only, never on the FOV. For instance,
+    prediction = predict_tiled(predict, image, layers=4, tile_size=256, batch_size=8)
+where predict maps a (n, tile, tile, channels) batch to (n, out, out, n_class).
+'''
+
+from __future__ import division
+import numpy as np
+
+def output_size(size, layers, filter_size=3, pool_size=2):
+    '''
+    Size of the U-Net output for an input of the given size, as tf_unet's
+    create_conv_net computes it (two valid convolutions per layer).
+    Output: the output size, or None if a pooling step does not divide evenly.
+    '''
+    for layer in range(layers):
+        size -= 2 * (filter_size - 1)
+        if layer < layers - 1:
+            if size <= 0 or size % pool_size:
+                return None
+            size //= pool_size
+    for layer in range(layers - 1):
+        size = size * pool_size - 2 * (filter_size - 1)
+    return size if size > 0 else None
+
+def valid_tile_size(size, layers, filter_size=3, pool_size=2):
+    '''
+    Smallest tile size, at least size, for which every pooling step divides evenly.
+    '''
+    while output_size(size, layers, filter_size, pool_size) is None:
+        size += 1
+    return size
+
+def predict_tiled(predict, image, layers, tile_size=256, batch_size=4, stitch='cosine', overlap=None,
+                  filter_size=3, pool_size=2):
+    '''
+    Predict a whole image tile by tile.
+    Input: the prediction function (a batch of tiles to a batch of class maps),
+    an (H, W) or (H, W, channels) image, the number of U-Net layers, the tile
+    size (rounded up to a valid size), the number of tiles per batch, the
+    stitching ('crop' or 'cosine'), the overlap of neighbouring tile centers for
+    cosine stitching [Default: a quarter of the center] and the U-Net geometry.
+    Output: the (H, W, n_class) prediction.
+    '''
+    if stitch not in ('crop', 'cosine'):
+        raise ValueError('Unknown stitching: {}'.format(stitch))
+    image = np.asarray(image, dtype=np.float32)
+    if image.ndim == 2:
+        image = image[..., np.newaxis]
+    height, width = image.shape[:2]
+    tile_size = valid_tile_size(tile_size, layers, filter_size, pool_size)
+    out = output_size(tile_size, layers, filter_size, pool_size)
+    border = (tile_size - out) // 2
+    if stitch == 'cosine':
+        overlap = out // 4 if overlap is None else overlap
+        step = max(out - overlap, 1)
+        weight = np.outer(_window(out), _window(out))[..., np.newaxis]
+    else:
+        step = out
+        weight = np.ones((out, out, 1), dtype=np.float32)
+
+    # pad so that every output pixel has its receptive field, and the FOV holds one tile
+    padded = np.pad(image, ((border, tile_size - border + max(out - height, 0)),
+                            (border, tile_size - border + max(out - width, 0)), (0, 0)), mode='reflect')
+    rows = _starts(max(height, out), out, step)
+    cols = _starts(max(width, out), out, step)
+    corners = [(r, c) for r in rows for c in cols]
+
+    result = total = None
+    for start in range(0, len(corners), batch_size):
+        batch = corners[start:start + batch_size]
+        tiles = np.stack([padded[r:r + tile_size, c:c + tile_size] for r, c in batch])
+        predicted = predict(tiles)
+        if result is None:
+            shape = (max(height, out), max(width, out))
+            result = np.zeros(shape + (predicted.shape[-1],), dtype=np.float32)
+            total = np.zeros(shape + (1,), dtype=np.float32)
+        for (r, c), tile in zip(batch, predicted):
+            result[r:r + out, c:c + out] += weight * tile
+            total[r:r + out, c:c + out] += weight
+    return (result / total)[:height, :width]
+
+def _starts(length, out, step):
+    '''
+    helper function for predict_tiled; tile origins along one axis, the last one
+    flush with the end.
+    '''
+    starts = list(range(0, length - out, step)) + [length - out]
+    return sorted(set(starts))
+
+def _window(size):
+    '''
+    helper function for predict_tiled; a sine squared window, positive everywhere.
+    '''
+    return np.sin(np.pi * (np.arange(size) + 0.5) / size) ** 2
@@ -19,10 +19,15 @@ from scipy.misc import imread,imsave
 import scipy
 from glob import glob
 from tf_unet import image_gen, image_util, unet, image_util
+from .predictor import Predictor, summary_image, dataset_name
+from .provider import PrefetchDataProvider
+from .postprocess import segment, label_regions, save_labels
+from Common import PredictionWriter
 
 def main(trainPath='traindata', testPath='/media/data4TbExt4/neuron/neurofinder.00.00.test/',
         layerNum=4, features=64, bsize=4, opm='adam',
-        iter=120, ep=220, display=60):
+        iter=120, ep=220, display=60, cache=None, tile=None, batch=4, stitch='cosine',
+        workers=0, crop=None):
     '''
     Driver function. Provides the required inputs for all the modules of the tf_unet package.
     Input:
@@ -35,6 +40,14 @@ def main(trainPath='traindata', testPath='/media/data4TbExt4/neuron/neurofinder.
     iter: The number of iterations during training. 
     ep: Number of epochs to be used for training. 
     display: This is used during display. Number of epochs after which the accuracy should be displayed.
+    cache: The folder of the movie cache shared with the other modules (optional). The testing frames are decoded only once.
+    tile: Size of the tiles for tiled inference (optional). The image is predicted tile by tile instead of in one pass,
+    so memory no longer grows with the FOV.
+    batch: Number of tiles per prediction batch.
+    stitch: How the tiles are put back together, 'cosine' (blended overlaps) or 'crop'.
+    workers: Number of threads preparing training samples in the background (optional). The training images are
+    decoded once into a memmap and served as random crops and flips from a prefetch queue.
+    crop: Size of the random training crops, with workers (optional; whole images otherwise).
     
     '''
     if sys.version_info[0] >= 3:
@@ -45,29 +58,36 @@ def main(trainPath='traindata', testPath='/media/data4TbExt4/neuron/neurofinder.
         print('No GPU!')
 
     # Train using Unet
-    data_provider = image_util.ImageDataProvider('{}/*.tif'.format(trainPath))
+    if workers:
+        data_provider = PrefetchDataProvider('{}/*.tif'.format(trainPath), crop_size=crop, n_workers=workers)
+    else:
+        data_provider = image_util.ImageDataProvider('{}/*.tif'.format(trainPath))
     net = unet.Unet(channels=1, n_class=2,
                     layers=layerNum, features_root=features)
     trainer = unet.Trainer(net, batch_size=bsize, optimizer=opm)
     path = trainer.train(data_provider, "./unet_trained",
                         training_iters=iter, epochs=ep, display_step=display)
+    if workers:
+        data_provider.report()
+        data_provider.close()
 
     # Test using the trained result
-    path = '{}/images'.format(testPath)
-    files = sorted(glob(path+'/*.tiff'))
-    testimg = array([imread(f) for f in files])
-    concatArray = testimg.sum(axis=0)
+    concatArray = summary_image(testPath, cache)[..., 0]
     print('The dimension of testing image is {}'.format(concatArray.shape))
     plt.imshow(concatArray)
-    concatArray = concatArray.reshape( (1,) + s.shape + (1,))
-    prediction = net.predict("./unet_trained/model.cpkt", concatArray)
-    prediction = prediction[0, :, :, 1]
+    with Predictor("./unet_trained/model.cpkt", net=net, layers=layerNum) as predictor:
+        prediction = predictor.predict([concatArray], batch_size=batch, tile=tile, stitch=stitch)[0]
+    prediction = prediction[:, :, 1]
     print('The output dimension is {}'.format(prediction.shape))
-    savetxt('predictedArray.txt', prediction)
+    labels = segment(prediction)
+    save_labels('predictedArray.npz', prediction, labels)
+    with PredictionWriter('submission.json') as writer:
+        writer.write(dataset_name(testPath), label_regions(labels), dims=labels.shape)
+    print('{} cells written to submission.json'.format(labels.max()))
 
     # Plot the results
     fig, ax = plt.subplots(1, 2 , figsize=(12,5))
-    ax[0].imshow(s[0,...,0], cmap='gray')
+    ax[0].imshow(concatArray, cmap='gray')
     ax[1].imshow(prediction, aspect="auto",cmap='gray')
     ax[0].set_title("Input")
     ax[1].set_title("Prediction")
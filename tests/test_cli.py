@@ -0,0 +1,50 @@
+'''
+The command lines given in the README reach the entry points with only the
+options they set, so the defaults of the functions apply to the others.
+'''
+
+import sys
+import pytest
+
+def test_thundernmf_sweep_readme(monkeypatch):
+    pytest.importorskip('tensorflow')
+    pytest.importorskip('extraction')
+    import ThunderNMF
+    from ThunderNMF.__main__ import main
+    calls = []
+    monkeypatch.setattr(ThunderNMF.sweep, 'main', lambda **kwargs: calls.append(kwargs))
+    main('sweep --_k 5 10 --_percentile 95 99 --_merge 0.1 0.2 --truth regions.json --block_cache nmf_cache'.split())
+    assert calls == [{'_k': [5, 10], '_percentile': [95, 99], '_merge': [0.1, 0.2],
+                      'truth': 'regions.json', 'block_cache': 'nmf_cache'}]
+
+def test_common_score_readme(monkeypatch):
+    import Common.__main__ as cli
+    calls = []
+    monkeypatch.setattr(cli, 'score_submission', lambda *args, **kwargs: calls.append((args, kwargs)))
+    monkeypatch.setattr(cli, 'print_scores', lambda scores: None)
+    cli.main('score regions.json submission.json'.split())
+    assert calls == [(('regions.json', 'submission.json'), {'threshold': 5})]
+
+@pytest.mark.skipif(sys.version_info[0] >= 3, reason='UNET needs Python 2.7')
+def test_unet_predict_readme(monkeypatch):
+    pytest.importorskip('tensorflow')
+    pytest.importorskip('tf_unet')
+    import UNET
+    from UNET.__main__ import main
+    calls = []
+    monkeypatch.setattr(UNET.predictor, 'main', lambda **kwargs: calls.append(kwargs))
+    main('predict neurofinder.00.00.test neurofinder.01.00.test --model unet_trained/model.cpkt --tile 256 '
+         '--cache movie_cache'.split())
+    assert calls == [{'testPaths': ['neurofinder.00.00.test', 'neurofinder.01.00.test'],
+                      'model': 'unet_trained/model.cpkt', 'tile': 256, 'cache': 'movie_cache'}]
+
+def test_common_benchmark_readme(monkeypatch):
+    import Common.__main__ as cli
+    calls = []
+    monkeypatch.setattr(cli.benchmark, 'synthetic', lambda workdir, T, H, W, neurons, seed: (workdir, T, H, W, neurons, seed))
+    monkeypatch.setattr(cli.benchmark, 'run', lambda *args, **kwargs: calls.append((args, kwargs)))
+    cli.main('benchmark --synthetic 1000 256 256 50 --synthetic 3000 512 512 200 --pipelines ThunderNMF CNMF'.split())
+    (datasets, pipelines), kwargs = calls[0]
+    assert datasets == [('benchmark', 1000, 256, 256, 50, 0), ('benchmark', 3000, 512, 512, 200, 0)]
+    assert pipelines == ['ThunderNMF', 'CNMF']
+    assert (kwargs['report'], kwargs['workdir']) == ('benchmark.json', 'benchmark')
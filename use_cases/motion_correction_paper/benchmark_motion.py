@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the motion correction strategies on synthetic non-rigid motion.
+
+A template (synthetic, or a cached .npy such as the '_templ_rigid.npy' saved by
+demo_motion_correction_nonrigid.py) is warped into a movie whose displacement is
+known at every pixel: a smooth random rigid drift, plus rotation, stretching and
+shearing fields (see utils_transformations), plus noise. Every strategy then
+corrects the movie against the template:
+    rigid         correct_rigid, the whole movie in one process
+    rigid_splits  motion_correction_piecewise, rigid, for every number of splits
+    piecewise     motion_correction_piecewise, for every strides x overlaps x splits
+    online        motion_correction_online, one pass with a rolling template
+and every run is reported with its frames per second, its peak memory (this
+process and its workers), the residual error of the corrected frames against
+the template (RMS over the template std, inside the margin the motion can reach), and for
+the rigid strategies the RMS error of the shifts against the mean ground truth
+displacement. The scratch files (the warped and decoded memmaps, the
+templates) are removed at the end; the TIFF movie and the report are kept.
+From the root of the repository (it imports Common, so it does not run as a
+script from this folder):
+    python -m use_cases.motion_correction_paper.benchmark_motion --T 2000 --size 512 512 --strides 48 96 128 --overlaps 16 32 --splits 14 56 --n_processes 4
+A strategy that cannot run here (piecewise needs caiman) is reported as skipped.
+"""
+from __future__ import division
+from __future__ import print_function
+from builtins import str
+from builtins import range
+from builtins import zip
+import os
+import json
+import glob
+import time
+import argparse
+import itertools
+from collections import OrderedDict
+import numpy as np
+from scipy.ndimage import gaussian_filter1d
+from skimage.external.tifffile import imsave
+from Common.benchmark import Recorder
+from Common.synthetic import synthetic_movie
+from use_cases.motion_correction_paper.utils_motion import correct_rigid, motion_correction_piecewise, motion_correction_online, iter_tiff
+from use_cases.motion_correction_paper.utils_transformations import warp_movie, coordinate_grid
+
+STRATEGIES = ['rigid', 'rigid_splits', 'piecewise', 'online']
+
+
+def synthetic_template(d1=512, d2=512, neurons=200, seed=0):
+    '''
+    The mean image of a short synthetic calcium movie (Common.synthetic), scaled to a maximum of 1.
+    '''
+    movie, _ = synthetic_movie(T=100, H=d1, W=d2, neurons=neurons, seed=seed)
+    template = movie.mean(0).astype(np.float32)
+    return template / template.max()
+
+
+def random_motion(T, max_shift=6, nonrigid=.5, smoothness=20, seed=0):
+    '''
+    Smooth random motion parameters of T frames (see warp_movie): a rigid drift
+    of at most max_shift pixels, rotation and shearing amounts in [-nonrigid,
+    nonrigid] and stretching factors in [1 - nonrigid, 1 + nonrigid].
+    '''
+    random = np.random.RandomState(seed)
+
+    def smooth(*shape):
+        walk = gaussian_filter1d(random.randn(T, *shape), smoothness, axis=0)
+        return walk / np.abs(walk).max()
+    return {'translation': max_shift * smooth(2), 'rotation': nonrigid * smooth(),
+            'stretching_factor': 1 + nonrigid * smooth(2), 'shearing_factor': nonrigid * smooth()}
+
+
+def make_movie(template, T, fname, motion, max_displacement=(5, 5), noise_sigma=.02, seed=0):
+    '''
+    Warp the template into a T frames TIFF movie fname with the motion of random_motion.
+    Returns the (T, d1, d2) float32 movie (a memmap next to the TIFF), the field
+    matrices and the translations of its frames.
+    '''
+    movie, M, translation = warp_movie(template, T, fname=os.path.splitext(fname)[0] + '_warped.mmap',
+                                       noise_sigma=noise_sigma, seed=seed, max_displacement=max_displacement, **motion)
+    imsave(fname, np.asarray(movie))
+    return movie, M, translation
+
+
+def rigid_truth(M, translation, shape, max_displacement, margin):
+    '''
+    The ground truth rigid shifts (rows, columns) of every frame: the mean of
+    its displacement inside the margin.
+    '''
+    X, Y = coordinate_grid(max_displacement, (0, 0), shape[1], shape[0])
+    inside = (slice(margin, shape[0] - margin), slice(margin, shape[1] - margin))
+    x, y = X[inside].mean(), Y[inside].mean()
+    vx = M[:, 0, 0] * x + M[:, 0, 1] * y + translation[:, 0]
+    vy = M[:, 1, 0] * x + M[:, 1, 1] * y + translation[:, 1]
+    return np.stack([vy, vx], axis=1)
+
+
+def residual(frames, template, margin, chunk_size=100):
+    '''
+    The mean over the frames of the RMS of (frame - template) relative to the
+    standard deviation of the template, inside the margin. frames is (T, d1, d2), or the path
+    of a (d1 * d2, T) order 'F' memmap.
+    '''
+    d1, d2 = template.shape
+    if not isinstance(frames, np.ndarray):
+        T = os.path.getsize(frames) // (4 * d1 * d2)
+        frames = np.memmap(frames, mode='r', dtype=np.float32, shape=(T, d2, d1)).transpose(0, 2, 1)
+    inside = (slice(None), slice(margin, d1 - margin), slice(margin, d2 - margin))
+    reference = template[inside[1:]]
+    errors = []
+    for start in range(0, len(frames), chunk_size):
+        chunk = np.asarray(frames[start:start + chunk_size][inside], dtype=np.float32)
+        errors.append(np.sqrt(np.nanmean((chunk - reference) ** 2, axis=(1, 2))))
+    return float(np.mean(np.concatenate(errors)) / np.std(reference))
+
+
+def _shifts(res):
+    '''
+    helper function for run; the rigid shifts of motion_correction_piecewise, in frame order.
+    '''
+    idxs = np.concatenate([r[1] for r in res])
+    shifts = np.array([info[0] for r in res for info in r[0]])
+    return shifts[np.argsort(idxs, kind='mergesort')]
+
+
+class _PoolView(object):
+    '''
+    helper class for run; a multiprocessing pool with the map_sync of an ipyparallel view.
+    '''
+
+    def __init__(self, n_processes):
+        import multiprocessing
+        self.pool = multiprocessing.Pool(n_processes)
+
+    def map_sync(self, function, iterable):
+        return self.pool.map(function, iterable)
+
+    def close(self):
+        self.pool.terminate()
+
+
+def run(T=1000, size=(512, 512), strategies=STRATEGIES, strides=[48, 96], overlaps=[16, 32], splits=[14, 56],
+        max_shifts=(12, 12), max_deviation_rigid=3, max_shift=6, nonrigid=.5, noise_sigma=.02, template=None,
+        n_processes=1, workdir='motion_benchmark', report='motion_benchmark.json', seed=0):
+    '''
+    Generate the movie and run the strategies on it.
+    Returns the report, as a dict (also written to the json report).
+    '''
+    report_path = os.path.abspath(report)
+    if template is not None:
+        template = np.load(template).astype(np.float32)
+        template[np.isnan(template)] = np.nanmean(template)
+        size = template.shape
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    dview = _PoolView(n_processes) if n_processes > 1 else None
+    results = []
+    fname = 'motion_{}x{}x{}.tif'.format(T, size[0], size[1])
+    try:
+        if template is None:
+            template = synthetic_template(size[0], size[1], seed=seed)
+        max_displacement = (5, 5)
+        margin = int(np.ceil(max_shift + nonrigid * (2 + np.sqrt(2)) * max(max_displacement))) + 2
+        print('Generating {}'.format(fname))
+        motion = random_motion(T, max_shift, nonrigid, seed=seed)
+        movie, M, translation = make_movie(template, T, fname, motion, max_displacement, noise_sigma, seed)
+        truth = rigid_truth(M, translation, size, max_displacement, margin)
+        baseline = residual(movie, template, margin)
+        print('uncorrected residual {:.3f}'.format(baseline))
+
+        runs = []
+        for strategy in strategies:
+            if strategy == 'rigid':
+                runs.append((strategy, {}))
+            elif strategy == 'rigid_splits':
+                runs.extend((strategy, {'splits': n}) for n in splits)
+            elif strategy == 'piecewise':
+                runs.extend((strategy, {'strides': (s, s), 'overlaps': (o, o), 'splits': n})
+                            for s, o, n in itertools.product(strides, overlaps, splits))
+            elif strategy == 'online':
+                runs.append((strategy, {}))
+
+        for strategy, params in runs:
+            print('{} {}'.format(strategy, params))
+            recorder = Recorder()
+            result = OrderedDict([('strategy', strategy)])
+            result.update(params)
+            shifts = None
+            try:
+                with recorder.stage('correct'):
+                    if strategy == 'rigid':
+                        corrected, shifts = correct_rigid(movie, template, max_shifts)
+                    elif strategy == 'rigid_splits':
+                        corrected, res = motion_correction_piecewise(fname, params['splits'], None, None, template=template,
+                                                                     max_shifts=max_shifts, max_deviation_rigid=0, dview=dview,
+                                                                     base_name='rigid')
+                        shifts = _shifts(res)
+                    elif strategy == 'piecewise':
+                        from caiman.motion_correction import tile_and_correct  # skip before any output is created
+                        corrected, res = motion_correction_piecewise(fname, params['splits'], params['strides'],
+                                                                     params['overlaps'], template=template,
+                                                                     max_shifts=max_shifts,
+                                                                     max_deviation_rigid=max_deviation_rigid,
+                                                                     dview=dview, base_name='piecewise')
+                    elif strategy == 'online':
+                        corrected, info, _ = motion_correction_online(iter_tiff(fname), 'online', template=template,
+                                                                      max_shifts=max_shifts)
+                        shifts = np.array([i[0] for i in info])
+            except ImportError as e:
+                print('  skipped: {}'.format(e))
+                result['skipped'] = str(e)
+                results.append(result)
+                continue
+            stage = recorder.stages[0]
+            result['seconds'] = stage['seconds']
+            result['fps'] = T / stage['seconds']
+            result['peak_rss_bytes'] = stage['peak_rss_bytes']
+            result['residual'] = residual(corrected, template, margin)
+            if shifts is not None:
+                result['shift_rmse'] = float(np.sqrt(np.mean(np.sum((shifts - truth) ** 2, axis=1))))
+            results.append(result)
+            if not isinstance(corrected, np.ndarray):
+                os.remove(corrected)
+    finally:
+        if dview is not None:
+            dview.close()
+        base_name = os.path.splitext(fname)[0]
+        for pattern in ['_frames_*.mmap', '_template_*.npy', '_warped.mmap']:
+            for name in glob.glob(base_name + pattern):
+                os.remove(name)
+        os.chdir(cwd)
+
+    print_table(results)
+    content = OrderedDict([('time', time.strftime('%Y-%m-%dT%H:%M:%S')), ('T', T), ('size', list(size)),
+                           ('max_shift', max_shift), ('nonrigid', nonrigid), ('noise_sigma', noise_sigma),
+                           ('n_processes', n_processes), ('uncorrected_residual', baseline), ('results', results)])
+    with open(report_path, 'w') as f:
+        json.dump(content, f, indent=2)
+    print('Report written to {}'.format(report_path))
+    return content
+
+
+def print_table(results):
+    '''
+    Print one line per run: strategy, parameters, fps, peak memory, errors.
+    '''
+    print('{:<13} {:>8} {:>9} {:>7} {:>8} {:>10} {:>9} {:>11}'.format(
+        'strategy', 'strides', 'overlaps', 'splits', 'fps', 'peak MB', 'residual', 'shift_rmse'))
+    for r in results:
+        head = '{:<13} {:>8} {:>9} {:>7}'.format(r['strategy'], str(r.get('strides', ('-',))[0]),
+                                                 str(r.get('overlaps', ('-',))[0]), str(r.get('splits', '-')))
+        if 'skipped' in r:
+            print(head + '  skipped')
+            continue
+        print(head + ' {:8.1f} {:10.1f} {:9.3f} {:>11}'.format(
+            r['fps'], r['peak_rss_bytes'] / 2 ** 20, r['residual'],
+            '{:.3f}'.format(r['shift_rmse']) if 'shift_rmse' in r else '-'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='motion correction benchmark on synthetic non-rigid motion',
+                                     argument_default=argparse.SUPPRESS)
+    parser.add_argument('--T', type=int, help='number of frames [Default: 1000]')
+    parser.add_argument('--size', nargs=2, type=int, metavar=('D1', 'D2'), help='synthetic frame size [Default: 512 512]')
+    parser.add_argument('--template', help='template .npy to warp instead of a synthetic one')
+    parser.add_argument('--strategies', nargs='+', choices=STRATEGIES, help='strategies to run [Default: all]')
+    parser.add_argument('--strides', nargs='+', type=int, help='piecewise strides to try [Default: 48 96]')
+    parser.add_argument('--overlaps', nargs='+', type=int, help='piecewise overlaps to try [Default: 16 32]')
+    parser.add_argument('--splits', nargs='+', type=int, help='numbers of splits to try [Default: 14 56]')
+    parser.add_argument('--max_shifts', nargs=2, type=int, help='max shifts searched [Default: 12 12]')
+    parser.add_argument('--max_deviation_rigid', type=int, help='piecewise max deviation from rigid [Default: 3]')
+    parser.add_argument('--max_shift', type=float, help='max rigid drift of the movie in pixels [Default: 6]')
+    parser.add_argument('--nonrigid', type=float, help='amount of rotation, stretching and shearing [Default: 0.5]')
+    parser.add_argument('--noise_sigma', type=float, help='noise relative to the template [Default: 0.02]')
+    parser.add_argument('--n_processes', type=int, help='worker processes of the split strategies [Default: 1]')
+    parser.add_argument('--workdir', help='scratch folder for the movies [Default: motion_benchmark]')
+    parser.add_argument('--report', help='path of the json report [Default: motion_benchmark.json]')
+    parser.add_argument('--seed', type=int, help='random seed [Default: 0]')
+    run(**vars(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -43,95 +43,11 @@ from caiman.motion_correction import tile_and_correct
 #%% in parallel
 
 
-def tile_and_correct_wrapper(params):
-
-    from skimage.external.tifffile import imread
-    import numpy as np
-    import cv2
-    try:
-        cv2.setNumThreads(1)
-    except:
-        1  # 'Open CV is naturally single threaded'
-
-    from caiman.motion_correction import tile_and_correct
-
-    img_name,  out_fname, idxs, shape_mov, template, strides, overlaps, max_shifts,\
-        add_to_movie, max_deviation_rigid, upsample_factor_grid, newoverlaps, newstrides, shifts_opencv = params
-
-    imgs = imread(img_name, key=idxs)
-    mc = np.zeros(imgs.shape, dtype=np.float32)
-    shift_info = []
-    for count, img in enumerate(imgs):
-        if count % 10 == 0:
-            print(count)
-        mc[count], total_shift, start_step, xy_grid = tile_and_correct(img, template, strides, overlaps, max_shifts, add_to_movie=add_to_movie, newoverlaps=newoverlaps, newstrides=newstrides,
-                                                                       upsample_factor_grid=upsample_factor_grid, upsample_factor_fft=10, show_movie=False, max_deviation_rigid=max_deviation_rigid, shifts_opencv=shifts_opencv)
-        shift_info.append([total_shift, start_step, xy_grid])
-    if out_fname is not None:
-        outv = np.memmap(out_fname, mode='r+', dtype=np.float32,
-                         shape=shape_mov, order='F')
-        outv[:, idxs] = np.reshape(
-            mc.astype(np.float32), (len(imgs), -1), order='F').T
-
-    return shift_info, idxs, np.nanmean(mc, 0)
-
-
-#%%
-def motion_correction_piecewise(fname, splits, strides, overlaps, add_to_movie=0, template=None, max_shifts=(12, 12), max_deviation_rigid=3, newoverlaps=None, newstrides=None,
-                                upsample_factor_grid=4, order='F', dview=None, save_movie=True, base_name='none', num_splits=None, shifts_opencv=False):
-    '''
-
-    '''
-
-    with TiffFile(fname) as tf:
-        d1, d2 = tf[0].shape
-        T = len(tf)
-
-    if type(splits) is int:
-        idxs = np.array_split(list(range(T)), splits)
-    else:
-        idxs = splits
-        save_movie = False
-
-    if template is None:
-        raise Exception('Not implemented')
-
-    shape_mov = (d1 * d2, T)
-
-    dims = d1, d2
-    if num_splits is not None:
-        idxs = np.array(idxs)[np.random.randint(0, len(idxs), num_splits)]
-        save_movie = False
-        print('**** MOVIE NOT SAVED BECAUSE num_splits is not None ****')
-
-    if save_movie:
-        if base_name is None:
-            base_name = fname[:-4]
-
-        fname_tot = base_name + '_d1_' + str(dims[0]) + '_d2_' + str(dims[1]) + '_d3_' + str(
-            1 if len(dims) == 2 else dims[2]) + '_order_' + str(order) + '_frames_' + str(T) + '_.mmap'
-        fname_tot = os.path.join(os.path.split(fname)[0], fname_tot)
-
-        np.memmap(fname_tot, mode='w+', dtype=np.float32,
-                  shape=shape_mov, order=order)
-    else:
-        fname_tot = None
-
-    pars = []
-
-    for idx in idxs:
-        pars.append([fname, fname_tot, idx, shape_mov, template, strides, overlaps, max_shifts, np.array(
-            add_to_movie, dtype=np.float32), max_deviation_rigid, upsample_factor_grid, newoverlaps, newstrides, shifts_opencv])
-
-    t1 = time.time()
-    if dview is not None:
-        res = dview.map_sync(tile_and_correct_wrapper, pars)
-    else:
-        res = list(map(tile_and_correct_wrapper, pars))
-
-    print((time.time() - t1))
-
-    return fname_tot, res
+try:
+    from use_cases.motion_correction_paper.utils_motion import motion_correction_piecewise
+except ImportError:
+    # run from this folder rather than from the root of the repository
+    from utils_motion import motion_correction_piecewise
 
 
 #%%
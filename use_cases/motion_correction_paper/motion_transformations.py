@@ -28,110 +28,12 @@ import caiman
 import pylab as pl
 import pandas
 #%%
-
-
-def create_rotation_field(max_displacement=(10, 10), center=(0, 0), nx=512, ny=512):
-
-    x = np.linspace(-max_displacement[0] - center[0],
-                    max_displacement[0] - center[0], nx)
-    y = np.linspace(-max_displacement[1] - center[1],
-                    max_displacement[1] - center[1], ny)
-    X, Y = np.meshgrid(x, y)
-    rho = np.sqrt(X**2, Y**2)
-    theta = np.arctan2(Y, X)
-
-    vx = -np.sin(theta) * rho
-    vy = np.cos(theta) * rho
-
-    return vx.astype(np.float32), vy.astype(np.float32)
-
-
-def create_stretching_field(stretching_factor=(1., 1.), max_displacement=(5, 5), center=(0, 0), nx=512, ny=512):
-    '''max shift would be equal to (max_displacement-center)*(stretching_factor-1)'''
-
-    x = np.linspace(-max_displacement[0] - center[0],
-                    max_displacement[0] - center[0], nx)
-    y = np.linspace(-max_displacement[1] - center[1],
-                    max_displacement[1] - center[1], ny)
-    X, Y = np.meshgrid(x, y)
-
-    X_stretch = X * stretching_factor[0]
-    Y_stretch = Y * stretching_factor[1]
-
-    vx = X_stretch - X
-    vy = Y_stretch - Y
-
-    return vx.astype(np.float32), vy.astype(np.float32)
-
-
-def create_shearing_field(shearing_factor=0., max_displacement=(5, 5), along_x=True, center=(0, 0), nx=512, ny=512):
-    '''set along_x to False for shearing along y axis'''
-
-    x = np.linspace(-max_displacement[0] - center[0],
-                    max_displacement[0] - center[0], nx)
-    y = np.linspace(-max_displacement[1] - center[1],
-                    max_displacement[1] - center[1], ny)
-    X, Y = np.meshgrid(x, y)
-
-    if along_x:
-        vx = shearing_factor * Y
-        vy = np.zeros((nx, ny))
-    else:
-        vx = np.zeros((nx, ny))
-        vy = shearing_factor * X
-
-    return vx.astype(np.float32), vy.astype(np.float32)
-
-#%
-
-
-def apply_field(inputImage, vx, vy):
-    mapX = np.zeros_like(inputImage, dtype=np.float32)
-    mapY = np.zeros_like(inputImage, dtype=np.float32)
-
-    map_orig_x = np.zeros(
-        (inputImage.shape[0], inputImage.shape[1]), dtype=np.float32)
-    map_orig_y = np.zeros(
-        (inputImage.shape[0], inputImage.shape[1]), dtype=np.float32)
-
-    for j in range(inputImage.shape[0]):
-        # print(j)
-        for i in range(inputImage.shape[1]):
-            map_orig_x[j, i] = i
-            map_orig_y[j, i] = j
-
-    mapX = map_orig_x + vx
-    mapY = map_orig_y + vy
-    new_img = cv2.remap(inputImage, mapX, mapY,
-                        cv2.INTER_CUBIC, None, cv2.BORDER_CONSTANT)
-    return new_img
-#%%
-
-
-def dispOpticalFlow(Image, Flow, Divisor=1):
-    "Display image with a visualisation of a flow over the top. A divisor controls the density of the quiver plot."
-    PictureShape = np.shape(Image)
-    # determine number of quiver points there will be
-    Imax = int(PictureShape[0] / Divisor)
-    Jmax = int(PictureShape[1] / Divisor)
-    # create a blank mask, on which lines will be drawn.
-    mask = np.zeros_like(Image)
-    for i in range(1, Imax):
-        for j in range(1, Jmax):
-            X1 = (i) * Divisor
-            Y1 = (j) * Divisor
-            X2 = int(X1 + Flow[X1, Y1, 1])
-            Y2 = int(Y1 + Flow[X1, Y1, 0])
-            X2 = np.clip(X2, 0, PictureShape[0])
-            Y2 = np.clip(Y2, 0, PictureShape[1])
-            # add all the lines to the mask
-#         mask = cv2.line(mask, (Y1,X1),(Y2,X2), [0, 0, 100], 2)
-            mask = cv2.arrowedLine(mask, (Y1, X1), (Y2, X2), [100, 0, 0], 1)
-
-    # superpose lines onto image
-    img = cv2.add(Image / np.max(Image) * 2, mask)
-    # print image
-    return img
+try:
+    from use_cases.motion_correction_paper.utils_transformations import create_rotation_field, create_stretching_field, create_shearing_field, apply_field, dispOpticalFlow
+except ImportError:
+    # run from this folder (python motion_transformations.py) rather than as
+    # python -m use_cases.motion_correction_paper.motion_transformations from the root
+    from utils_transformations import create_rotation_field, create_stretching_field, create_shearing_field, apply_field, dispOpticalFlow
 
 
 #%%
@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+"""
+Piecewise rigid motion correction of a TIFF movie, split across workers.
+
+The movie is decoded once into a C-ordered float32 memmap next to the TIFF
+(reused as long as the TIFF is unchanged, and left there for the next calls:
+delete '<name>_frames_*.mmap' once done with a movie), and the template is
+saved once per call to a .npy file, removed when the call returns. Each worker
+only receives the paths, the frame range of its split and the correction
+parameters; it maps the movie and the template once and keeps them open for its
+next splits, so a split costs neither a TIFF header parse nor a pickled
+template, and finer splits balance the load better.
+
+Used by demo_motion_correction_nonrigid.py and DeZeeuw/abadura_demo.py:
+    fname_tot, res = motion_correction_piecewise(fname, 56, strides, overlaps, template=template, dview=dview)
+
+Long sessions can instead be corrected in one pass, as the frames arrive,
+against a rolling template (no template needed upfront):
+    fname_tot, shifts, template = motion_correction_online(iter_tiff(fname), fname[:-4] + '_online')
+"""
+from __future__ import division
+from __future__ import print_function
+from builtins import str
+from builtins import range
+import os
+import hashlib
+import numpy as np
+import time
+from itertools import chain
+from skimage.external.tifffile import TiffFile
+
+# memmaps opened by this worker, by path, modification time and shape
+_mapped = {}
+
+
+def decode_movie(fname, chunk_size=500):
+    '''
+    Decode the frames of a TIFF once into a (T, d1, d2) float32 memmap.
+
+    The memmap is reused as long as it is newer than the TIFF. It is not removed
+    afterwards: it is the cache of the next calls on the same TIFF.
+
+    Returns the path of the memmap and the shape of the movie.
+    '''
+    with TiffFile(fname) as tf:
+        d1, d2 = tf[0].shape
+        T = len(tf)
+        shape = (T, d1, d2)
+        movie_name = os.path.splitext(fname)[0] + '_frames_{}x{}x{}.mmap'.format(T, d1, d2)
+        if os.path.exists(movie_name) and os.path.getmtime(movie_name) >= os.path.getmtime(fname):
+            return movie_name, shape
+        tmp_name = movie_name + '.tmp-' + str(os.getpid())
+        movie = np.memmap(tmp_name, mode='w+', dtype=np.float32, shape=shape)
+        for start in range(0, T, chunk_size):
+            stop = min(start + chunk_size, T)
+            movie[start:stop] = tf.asarray(key=list(range(start, stop))).reshape(-1, d1, d2)
+        movie.flush()
+        del movie
+    os.rename(tmp_name, movie_name)
+    return movie_name, shape
+
+
+def save_template(template, base_name):
+    '''
+    Save the template to a .npy named after its content and this process, for
+    the workers to map. The caller removes it once the workers are done.
+    '''
+    template = np.ascontiguousarray(template, dtype=np.float32)
+    template_name = '{}_template_{}-{}.npy'.format(base_name, hashlib.sha1(template.tobytes()).hexdigest()[:12],
+                                                   os.getpid())
+    np.save(template_name, template)
+    return template_name
+
+
+def mapped(name, shape=None):
+    '''
+    The memmap of a decoded movie (with shape) or of a template (.npy) in this
+    worker, opened on first use only. A file rewritten since is opened again,
+    and the memmaps of files removed or rewritten are dropped.
+    '''
+    key = (name, os.path.getmtime(name), shape)
+    if key not in _mapped:
+        for stale in [k for k in _mapped if not os.path.exists(k[0]) or os.path.getmtime(k[0]) != k[1]]:
+            del _mapped[stale]
+        if shape is None:
+            _mapped[key] = np.load(name, mmap_mode='r')
+        else:
+            _mapped[key] = np.memmap(name, mode='r', dtype=np.float32, shape=tuple(shape))
+    return _mapped[key]
+
+
+def template_spectrum(template):
+    '''
+    The half spectrum of a template, computed once for register_rigid.
+    '''
+    return np.fft.rfft2(np.asarray(template, dtype=np.float32))
+
+
+def register_rigid(frames, template, max_shifts=(12, 12), upsample_factor=10):
+    '''
+    Rigid shifts of a chunk of frames against a template, all frames at once.
+
+    template is the (d1, d2) image or its template_spectrum. The cross-power
+    spectra of the whole (n, d1, d2) chunk come from one batched rfft2, the
+    integer peaks are searched within max_shifts, and refined to
+    1 / upsample_factor of a pixel by an upsampled DFT around each peak
+    (Guizar-Sicairos et al., 2008), again for all frames at once.
+
+    Returns the (n, 2) shifts that align the frames with the template (see
+    apply_rigid_shifts) and the half spectra of the frames.
+    '''
+    frames = np.asarray(frames, dtype=np.float32)
+    n, d1, d2 = frames.shape
+    if np.iscomplexobj(template):
+        spectrum = template
+    else:
+        spectrum = template_spectrum(template)
+    frames_fft = np.fft.rfft2(frames)
+    cross = np.conj(frames_fft) * spectrum[np.newaxis]  # template, correlated with each frame
+    corr = np.fft.irfft2(cross, s=(d1, d2))
+
+    # integer peak within [-max_shift, max_shift] on each axis
+    m1, m2 = [min(int(m), (d - 1) // 2) for m, d in zip(max_shifts, (d1, d2))]
+    lags1 = np.r_[0:m1 + 1, -m1:0]
+    lags2 = np.r_[0:m2 + 1, -m2:0]
+    window = corr[:, lags1[:, np.newaxis], lags2[np.newaxis, :]].reshape(n, -1)
+    peak1, peak2 = np.unravel_index(np.argmax(window, axis=1), (len(lags1), len(lags2)))
+    shifts = np.stack([lags1[peak1], lags2[peak2]], axis=1).astype(np.float64)
+    if upsample_factor <= 1:
+        return shifts, frames_fft
+
+    # upsampled cross-correlation on a 1.5 pixel wide grid around every peak,
+    # summed over the half spectrum: the columns 0 < k < d2 / 2 stand for their
+    # conjugates as well, hence count twice in the real part
+    region = int(np.ceil(upsample_factor * 1.5))
+    grid = (np.arange(region) - region // 2) / upsample_factor
+    freq1 = np.fft.fftfreq(d1) * d1
+    freq2 = np.arange(d2 // 2 + 1)
+    weight = np.full(len(freq2), 2., dtype=np.float32)
+    weight[0] = 1
+    if d2 % 2 == 0:
+        weight[-1] = 1
+    kernel1 = np.exp(2j * np.pi / d1 * (shifts[:, :1, np.newaxis] + grid[np.newaxis, :, np.newaxis]) *
+                     freq1[np.newaxis, np.newaxis, :]).astype(np.complex64)
+    kernel2 = np.exp(2j * np.pi / d2 * (shifts[:, 1:, np.newaxis] + grid[np.newaxis, :, np.newaxis]) *
+                     freq2[np.newaxis, np.newaxis, :]).astype(np.complex64)
+    upsampled = np.matmul(np.matmul(kernel1, cross * weight), kernel2.transpose(0, 2, 1)).real
+    sub1, sub2 = np.unravel_index(np.argmax(upsampled.reshape(n, -1), axis=1), (region, region))
+    shifts += np.stack([grid[sub1], grid[sub2]], axis=1)
+    return shifts, frames_fft
+
+
+def apply_rigid_shifts(frames_fft, shifts, shape, border_nan=False):
+    '''
+    Shift all the frames at once, from their half spectra, by a phase ramp: the
+    corrected frame at (i, j) is the frame at (i - shifts[0], j - shifts[1]).
+
+    The rows and columns wrapped around the borders are set to NaN if border_nan.
+    Returns the (n, d1, d2) float32 shifted frames.
+    '''
+    d1, d2 = shape
+    freq1 = np.fft.fftfreq(d1)
+    freq2 = np.fft.rfftfreq(d2)
+    # separable ramp: a row factor times a column factor
+    ramp1 = np.exp(-2j * np.pi * shifts[:, :1] * freq1[np.newaxis]).astype(np.complex64)
+    ramp2 = np.exp(-2j * np.pi * shifts[:, 1:] * freq2[np.newaxis]).astype(np.complex64)
+    frames_fft = frames_fft * ramp1[:, :, np.newaxis]
+    frames_fft *= ramp2[:, np.newaxis, :]
+    shifted = np.fft.irfft2(frames_fft, s=(d1, d2)).astype(np.float32)
+    if border_nan:
+        rows = np.arange(d1)[np.newaxis]
+        cols = np.arange(d2)[np.newaxis]
+        bad_rows = (rows < np.ceil(shifts[:, :1])) | (rows >= d1 + np.floor(shifts[:, :1]))
+        bad_cols = (cols < np.ceil(shifts[:, 1:])) | (cols >= d2 + np.floor(shifts[:, 1:]))
+        shifted[bad_rows[:, :, np.newaxis] | bad_cols[:, np.newaxis, :]] = np.nan
+    return shifted
+
+
+def correct_rigid(frames, template, max_shifts=(12, 12), upsample_factor=10, batch_size=100, border_nan=False):
+    '''
+    Rigid motion correction of a chunk of frames, batch_size frames at a time
+    (this bounds the memory of the spectra).
+
+    Returns the (n, d1, d2) float32 corrected frames and their (n, 2) shifts.
+    '''
+    spectrum = template_spectrum(template)
+    corrected = np.empty(np.shape(frames), dtype=np.float32)
+    shifts = np.empty((len(frames), 2))
+    for start in range(0, len(frames), batch_size):
+        batch = slice(start, start + batch_size)
+        shifts[batch], frames_fft = register_rigid(frames[batch], spectrum, max_shifts, upsample_factor)
+        corrected[batch] = apply_rigid_shifts(frames_fft, shifts[batch], corrected.shape[1:], border_nan)
+    return corrected, shifts
+
+
+def correct_frames(imgs, template, strides, overlaps, max_shifts, add_to_movie=0, max_deviation_rigid=3, upsample_factor_grid=4,
+                   newoverlaps=None, newstrides=None, shifts_opencv=False):
+    '''
+    Correct a chunk of frames against template: all at once if rigid (strides
+    None and max_deviation_rigid 0, see correct_rigid), else frame by frame
+    with tile_and_correct.
+
+    Returns the float32 corrected frames and the [shift, start_step, xy_grid] of every frame.
+    '''
+    if strides is None and max_deviation_rigid == 0:
+        mc, shifts = correct_rigid(imgs, template, max_shifts, upsample_factor=10)
+        return mc, [[tuple(shift), None, None] for shift in shifts]
+
+    from caiman.motion_correction import tile_and_correct
+
+    mc = np.zeros(np.shape(imgs), dtype=np.float32)
+    shift_info = []
+    for count, img in enumerate(imgs):
+        if count % 10 == 0:
+            print(count)
+        mc[count], total_shift, start_step, xy_grid = tile_and_correct(img, template, strides, overlaps, max_shifts, add_to_movie=add_to_movie, newoverlaps=newoverlaps, newstrides=newstrides,
+                                                                       upsample_factor_grid=upsample_factor_grid, upsample_factor_fft=10, show_movie=False, max_deviation_rigid=max_deviation_rigid, shifts_opencv=shifts_opencv)
+        shift_info.append([total_shift, start_step, xy_grid])
+    return mc, shift_info
+
+
+def tile_and_correct_wrapper(params):
+
+    import numpy as np
+    import cv2
+    try:
+        cv2.setNumThreads(1)
+    except:
+        1  # 'Open CV is naturally single threaded'
+
+    movie_name, movie_shape, template_name, out_fname, idxs, shape_mov, strides, overlaps, max_shifts,\
+        add_to_movie, max_deviation_rigid, upsample_factor_grid, newoverlaps, newstrides, shifts_opencv = params
+
+    if isinstance(idxs, tuple):
+        idxs = np.arange(*idxs)
+        imgs = mapped(movie_name, movie_shape)[idxs[0]:idxs[-1] + 1]
+    else:
+        imgs = mapped(movie_name, movie_shape)[idxs]
+    template = mapped(template_name)
+    mc, shift_info = correct_frames(imgs, template, strides, overlaps, max_shifts, add_to_movie, max_deviation_rigid,
+                                    upsample_factor_grid, newoverlaps, newstrides, shifts_opencv)
+    if out_fname is not None:
+        outv = np.memmap(out_fname, mode='r+', dtype=np.float32,
+                         shape=shape_mov, order='F')
+        outv[:, idxs] = np.reshape(
+            mc.astype(np.float32), (len(imgs), -1), order='F').T
+
+    return shift_info, idxs, np.nanmean(mc, 0)
+
+
+def motion_correction_piecewise(fname, splits, strides, overlaps, add_to_movie=0, template=None, max_shifts=(12, 12), max_deviation_rigid=3, newoverlaps=None, newstrides=None,
+                                upsample_factor_grid=4, order='F', dview=None, save_movie=True, base_name='none', num_splits=None, shifts_opencv=False):
+    '''
+    Piecewise rigid motion correction of the TIFF fname against template.
+
+    splits is the number of splits of the movie across time, or the list of the
+    frame indices of every split. The frames are decoded once (see decode_movie)
+    and the workers receive frame ranges, not frames nor templates. The decoded
+    movie is kept next to the TIFF for the next calls; the template file is removed.
+
+    Returns the path of the corrected movie (None if not saved) and, for every
+    split, the shifts, the frame indices and the mean corrected frame.
+    '''
+    if template is None:
+        raise Exception('Not implemented: pass a template, or correct in one pass with motion_correction_online')
+
+    movie_name, movie_shape = decode_movie(fname)
+    T, d1, d2 = movie_shape
+
+    if type(splits) is int:
+        idxs = np.array_split(list(range(T)), splits)
+    else:
+        idxs = splits
+        save_movie = False
+
+    shape_mov = (d1 * d2, T)
+
+    dims = d1, d2
+    if num_splits is not None:
+        idxs = np.array(idxs)[np.random.randint(0, len(idxs), num_splits)]
+        save_movie = False
+        print('**** MOVIE NOT SAVED BECAUSE num_splits is not None ****')
+
+    if save_movie:
+        if base_name is None:
+            base_name = fname[:-4]
+
+        fname_tot = base_name + '_d1_' + str(dims[0]) + '_d2_' + str(dims[1]) + '_d3_' + str(
+            1 if len(dims) == 2 else dims[2]) + '_order_' + str(order) + '_frames_' + str(T) + '_.mmap'
+        fname_tot = os.path.join(os.path.split(fname)[0], fname_tot)
+
+        np.memmap(fname_tot, mode='w+', dtype=np.float32,
+                  shape=shape_mov, order=order)
+    else:
+        fname_tot = None
+
+    template_name = save_template(template, os.path.splitext(fname)[0])
+    pars = []
+
+    for idx in idxs:
+        idx = np.asarray(idx)
+        if len(idx) and np.all(np.diff(idx) == 1):
+            idx = (int(idx[0]), int(idx[-1]) + 1)  # contiguous split: only its range is sent
+        pars.append([movie_name, movie_shape, template_name, fname_tot, idx, shape_mov, strides, overlaps, max_shifts, np.array(
+            add_to_movie, dtype=np.float32), max_deviation_rigid, upsample_factor_grid, newoverlaps, newstrides, shifts_opencv])
+
+    t1 = time.time()
+    try:
+        if dview is not None:
+            res = dview.map_sync(tile_and_correct_wrapper, pars)
+        else:
+            res = list(map(tile_and_correct_wrapper, pars))
+    finally:
+        os.remove(template_name)
+
+    print((time.time() - t1))
+
+    return fname_tot, res
+
+
+def iter_tiff(fname, chunk_size=100):
+    '''
+    The frames of a TIFF, decoded chunk_size at a time.
+    '''
+    with TiffFile(fname) as tf:
+        d1, d2 = tf[0].shape
+        T = len(tf)
+        for start in range(0, T, chunk_size):
+            for frame in tf.asarray(key=list(range(start, min(start + chunk_size, T)))).reshape(-1, d1, d2):
+                yield frame
+
+
+def motion_correction_online(frames, base_name, template=None, strides=None, overlaps=None, max_shifts=(12, 12), max_deviation_rigid=0,
+                             add_to_movie=0, upsample_factor_grid=4, newoverlaps=None, newstrides=None, shifts_opencv=False,
+                             batch_size=10, update_every=250, window=500, init_frames=100):
+    '''
+    One pass motion correction of frames as they arrive from any iterable (e.g.
+    iter_tiff, or an acquisition), against a rolling template.
+
+    Frames are corrected batch_size at a time (see correct_frames) and appended
+    to the memmap at once, so a frame waits for at most batch_size - 1 others.
+    The template is the median of the last window corrected frames, updated
+    every update_every frames. Without a template, the first init_frames frames
+    are buffered, and the template is the median of these frames corrected
+    against their raw median. Every new template is registered to this initial
+    one and shifted onto it before use, so that the small misalignment of each
+    update does not add up into a drift of the reference over a long session.
+
+    The memmap is '<base_name>_online.partial.mmap' while being written, frames
+    in Fortran order one after the other, i.e. a (d1 * d2, T) order 'F' movie.
+    It is renamed to the usual
+    '<base_name>_d1_.._d2_.._d3_1_order_F_frames_.._.mmap' once frames run out.
+
+    Returns the path of the corrected movie, the shift info of every frame (as
+    in correct_frames) and the last template.
+    '''
+    frames = iter(frames)
+    buffered = []
+    if template is None:
+        for frame in frames:
+            buffered.append(np.asarray(frame, dtype=np.float32))
+            if len(buffered) == init_frames:
+                break
+        if not buffered:
+            raise Exception('No frames to correct')
+        buffered = np.array(buffered)
+        template = np.median(buffered, 0)
+        template = np.nanmedian(correct_frames(buffered, template, strides, overlaps, max_shifts, add_to_movie, max_deviation_rigid,
+                                               upsample_factor_grid, newoverlaps, newstrides, shifts_opencv)[0], 0)
+    template = np.asarray(template, dtype=np.float32)
+    d1, d2 = template.shape
+    reference = template_spectrum(template)
+
+    partial_name = base_name + '_online.partial.mmap'
+    recent = np.empty((window, d1, d2), dtype=np.float32)
+    shift_info = []
+    T = 0
+    since_update = 0
+    t1 = time.time()
+    with open(partial_name, 'wb') as out:
+        for chunk in _chunks(chain(buffered, frames), batch_size):
+            mc, info = correct_frames(chunk, template, strides, overlaps, max_shifts, add_to_movie, max_deviation_rigid,
+                                      upsample_factor_grid, newoverlaps, newstrides, shifts_opencv)
+            np.ascontiguousarray(mc.transpose(0, 2, 1)).tofile(out)
+            out.flush()
+            shift_info.extend(info)
+            keep = mc[-window:]
+            recent[np.arange(T + len(mc) - len(keep), T + len(mc)) % window] = keep
+            T += len(mc)
+            since_update += len(mc)
+            if since_update >= update_every:
+                template = np.nanmedian(recent[:min(T, window)], 0)[np.newaxis]
+                offset, template_fft = register_rigid(template, reference, max_shifts, upsample_factor=10)
+                template = apply_rigid_shifts(template_fft, offset, (d1, d2))[0]
+                since_update = 0
+    print('{} frames in {:.1f}s'.format(T, time.time() - t1))
+
+    fname_tot = base_name + '_d1_' + str(d1) + '_d2_' + str(d2) + '_d3_1_order_F_frames_' + str(T) + '_.mmap'
+    os.rename(partial_name, fname_tot)
+    return fname_tot, shift_info, template
+
+
+def _chunks(frames, size):
+    '''
+    helper function for motion_correction_online; groups frames into float32 chunks of size frames.
+    '''
+    chunk = []
+    for frame in frames:
+        chunk.append(frame)
+        if len(chunk) == size:
+            yield np.array(chunk, dtype=np.float32)
+            chunk = []
+    if chunk:
+        yield np.array(chunk, dtype=np.float32)
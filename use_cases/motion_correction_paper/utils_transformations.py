@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic non-rigid motion: displacement fields and their application to frames.
+
+The rotation, stretching and shearing fields of motion_transformations.py are
+all linear in the coordinates of a grid spanning [-max_displacement - center,
+max_displacement - center], so the field of a frame is the 2x2 matrix of its
+motion applied to that grid, and the fields of a whole chunk of frames are one
+broadcast product. Grids are built once per shape and cached:
+    vx, vy = compose_fields(rotation=np.linspace(0, 1, 100), shearing_factor=.5, max_displacement=(6, 6))
+    frames = apply_fields(template, vx, vy)
+    movie, M, translation = warp_movie(template, 2000, fname='warped.mmap', rotation=np.random.rand(2000))
+A frame warped by (vx, vy) shows at pixel (y, x) the template at (y + vy, x + vx),
+so correcting it means shifting it by (vy, vx).
+"""
+from __future__ import division
+from __future__ import print_function
+from builtins import range
+import numpy as np
+import cv2
+
+# coordinate grids, by arguments
+_grids = {}
+
+
+def coordinate_grid(max_displacement=(5, 5), center=(0, 0), nx=512, ny=512):
+    '''
+    The (ny, nx) X and Y coordinates spanning [-max_displacement - center,
+    max_displacement - center], built once and cached (read only).
+    '''
+    key = (tuple(float(m) for m in max_displacement), tuple(float(c) for c in center), int(nx), int(ny))
+    if key not in _grids:
+        x = np.linspace(-max_displacement[0] - center[0],
+                        max_displacement[0] - center[0], nx)
+        y = np.linspace(-max_displacement[1] - center[1],
+                        max_displacement[1] - center[1], ny)
+        X, Y = np.meshgrid(x.astype(np.float32), y.astype(np.float32))
+        X.setflags(write=False)
+        Y.setflags(write=False)
+        _grids[key] = X, Y
+    return _grids[key]
+
+
+def pixel_grid(shape):
+    '''
+    The float32 column and row indices of every pixel of a (d1, d2) frame, cached (read only).
+    '''
+    key = (int(shape[0]), int(shape[1]))
+    if key not in _grids:
+        rows, cols = np.indices(key, dtype=np.float32)
+        rows.setflags(write=False)
+        cols.setflags(write=False)
+        _grids[key] = cols, rows
+    return _grids[key]
+
+
+def create_rotation_field(max_displacement=(10, 10), center=(0, 0), nx=512, ny=512):
+    '''
+    Rotation about center: the displacement is the position turned by 90 degrees.
+    '''
+    X, Y = coordinate_grid(max_displacement, center, nx, ny)
+    return -Y, X.copy()
+
+
+def create_stretching_field(stretching_factor=(1., 1.), max_displacement=(5, 5), center=(0, 0), nx=512, ny=512):
+    '''max shift would be equal to (max_displacement-center)*(stretching_factor-1)'''
+    X, Y = coordinate_grid(max_displacement, center, nx, ny)
+    return (X * np.float32(stretching_factor[0] - 1)), (Y * np.float32(stretching_factor[1] - 1))
+
+
+def create_shearing_field(shearing_factor=0., max_displacement=(5, 5), along_x=True, center=(0, 0), nx=512, ny=512):
+    '''set along_x to False for shearing along y axis'''
+    X, Y = coordinate_grid(max_displacement, center, nx, ny)
+    if along_x:
+        return Y * np.float32(shearing_factor), np.zeros_like(X)
+    else:
+        return np.zeros_like(X), X * np.float32(shearing_factor)
+
+
+def field_matrices(rotation=0., stretching_factor=(1., 1.), shearing_factor=0., along_x=True):
+    '''
+    The (n, 2, 2) matrices M of the sum of the fields, (vx, vy) = M (X, Y), for
+    per frame arrays (or scalars) of the amount of rotation (1 is
+    create_rotation_field), of the stretching factors along x and y, and of the
+    shearing factor.
+    '''
+    rotation = np.atleast_1d(np.asarray(rotation, dtype=np.float32))
+    stretching_factor = np.atleast_2d(np.asarray(stretching_factor, dtype=np.float32))
+    shearing_factor = np.atleast_1d(np.asarray(shearing_factor, dtype=np.float32))
+    n = max(len(rotation), len(stretching_factor), len(shearing_factor))
+    M = np.zeros((n, 2, 2), dtype=np.float32)
+    M[:, 0, 1] -= rotation
+    M[:, 1, 0] += rotation
+    M[:, 0, 0] += stretching_factor[:, 0] - 1
+    M[:, 1, 1] += stretching_factor[:, 1] - 1
+    if along_x:
+        M[:, 0, 1] += shearing_factor
+    else:
+        M[:, 1, 0] += shearing_factor
+    return M
+
+
+def compose_fields(rotation=0., stretching_factor=(1., 1.), shearing_factor=0., along_x=True, max_displacement=(5, 5),
+                   center=(0, 0), nx=512, ny=512):
+    '''
+    The rotation + stretching + shearing fields of every frame at once (see field_matrices).
+    Returns the (n, ny, nx) float32 vx and vy.
+    '''
+    M = field_matrices(rotation, stretching_factor, shearing_factor, along_x)
+    return matrices_to_fields(M, max_displacement, center, nx, ny)
+
+
+def matrices_to_fields(M, max_displacement=(5, 5), center=(0, 0), nx=512, ny=512):
+    '''
+    The fields (vx, vy) = M (X, Y) of (n, 2, 2) field matrices, on the coordinate_grid.
+    '''
+    X, Y = coordinate_grid(max_displacement, center, nx, ny)
+    vx = M[:, 0, 0, np.newaxis, np.newaxis] * X + M[:, 0, 1, np.newaxis, np.newaxis] * Y
+    vy = M[:, 1, 0, np.newaxis, np.newaxis] * X + M[:, 1, 1, np.newaxis, np.newaxis] * Y
+    return vx, vy
+
+
+def apply_field(inputImage, vx, vy):
+    '''
+    Warp one image by the field (vx, vy), bicubic, zero outside.
+    '''
+    cols, rows = pixel_grid(np.shape(inputImage))
+    mapX = cols + vx
+    mapY = rows + vy
+    new_img = cv2.remap(inputImage, mapX, mapY,
+                        cv2.INTER_CUBIC, None, cv2.BORDER_CONSTANT)
+    return new_img
+
+
+def apply_fields(images, vx, vy, out=None):
+    '''
+    Warp a chunk of frames by their fields: images is (n, d1, d2), or one
+    template (d1, d2) warped by each of the n fields; vx and vy are (n, d1, d2),
+    or one field shared by all the frames.
+
+    The maps of the whole chunk are computed at once; cv2.remap then runs per frame.
+    Returns the (n, d1, d2) float32 warped frames (in out, if given).
+    '''
+    images = np.asarray(images, dtype=np.float32)
+    vx = np.asarray(vx, dtype=np.float32)
+    vy = np.asarray(vy, dtype=np.float32)
+    shape = images.shape[-2:]
+    n = max(len(images) if images.ndim == 3 else 1, len(vx) if vx.ndim == 3 else 1)
+    cols, rows = pixel_grid(shape)
+    mapX = np.broadcast_to(cols + vx, (n,) + shape)
+    mapY = np.broadcast_to(rows + vy, (n,) + shape)
+    images = np.broadcast_to(images, (n,) + shape)
+    if out is None:
+        out = np.empty((n,) + shape, dtype=np.float32)
+    for i in range(n):
+        out[i] = cv2.remap(images[i], mapX[i], mapY[i], cv2.INTER_CUBIC, None, cv2.BORDER_CONSTANT)
+    return out
+
+
+def warp_movie(template, T, fname=None, chunk_size=100, noise_sigma=0., seed=0, translation=(0., 0.), rotation=0.,
+               stretching_factor=(1., 1.), shearing_factor=0., along_x=True, max_displacement=(5, 5), center=(0, 0)):
+    '''
+    A movie of T frames of the template, each warped by its own field, plus
+    Gaussian noise of std noise_sigma * template (as in motion_transformations.py).
+
+    The motion parameters are per frame arrays (or scalars): the rigid
+    translation (tx, ty) plus the fields of field_matrices. The fields are generated and applied chunk_size frames at a time, and the
+    frames written to the (T, d1, d2) float32 memmap fname if given.
+
+    Returns the movie, the (T, 2, 2) field matrices and the (T, 2) translations
+    of the frames (with matrices_to_fields, the ground truth displacement of any
+    frame).
+    '''
+    template = np.asarray(template, dtype=np.float32)
+    d1, d2 = template.shape
+    M = field_matrices(rotation, stretching_factor, shearing_factor, along_x)
+    M = np.broadcast_to(M, (T, 2, 2))
+    translation = np.broadcast_to(np.asarray(translation, dtype=np.float32), (T, 2))
+    if fname is None:
+        movie = np.empty((T, d1, d2), dtype=np.float32)
+    else:
+        movie = np.memmap(fname, mode='w+', dtype=np.float32, shape=(T, d1, d2))
+    random = np.random.RandomState(seed)
+    for start in range(0, T, chunk_size):
+        vx, vy = matrices_to_fields(M[start:start + chunk_size], max_displacement, center, d2, d1)
+        vx += translation[start:start + chunk_size, 0, np.newaxis, np.newaxis]
+        vy += translation[start:start + chunk_size, 1, np.newaxis, np.newaxis]
+        chunk = apply_fields(template, vx, vy, out=movie[start:start + chunk_size])
+        if noise_sigma:
+            chunk += random.randn(*chunk.shape).astype(np.float32) * noise_sigma * template
+    if fname is not None:
+        movie.flush()
+    return movie, np.array(M), np.array(translation)
+
+
+def dispOpticalFlow(Image, Flow, Divisor=1):
+    "Display image with a visualisation of a flow over the top. A divisor controls the density of the quiver plot."
+    PictureShape = np.shape(Image)
+    # arrows from every Divisor-th pixel (rows X, columns Y), all at once
+    X1, Y1 = np.meshgrid(np.arange(1, int(PictureShape[0] / Divisor)) * Divisor,
+                         np.arange(1, int(PictureShape[1] / Divisor)) * Divisor, indexing='ij')
+    X1, Y1 = X1.ravel(), Y1.ravel()
+    X2 = np.clip((X1 + Flow[X1, Y1, 1]).astype(int), 0, PictureShape[0])
+    Y2 = np.clip((Y1 + Flow[X1, Y1, 0]).astype(int), 0, PictureShape[1])
+    # arrow heads as drawn by cv2.arrowedLine: 0.1 of the length, at 45 degrees
+    tip = 0.1 * np.hypot(X1 - X2, Y1 - Y2)
+    angle = np.arctan2(X1 - X2, Y1 - Y2)
+    end = np.stack([Y2, X2], axis=1)
+    starts = [np.stack([Y1, X1], axis=1)] + [np.stack([np.round(Y2 + tip * np.cos(angle + s * np.pi / 4)),
+                                                       np.round(X2 + tip * np.sin(angle + s * np.pi / 4))], axis=1) for s in (1, -1)]
+    lines = np.concatenate([np.stack([start, end], axis=1) for start in starts]).astype(np.int32)
+    # create a blank mask, and draw all the lines in one call
+    mask = np.zeros_like(Image)
+    mask = cv2.polylines(mask, list(lines), False, [100, 0, 0], 1)
+
+    # superpose lines onto image
+    img = cv2.add(Image / np.max(Image) * 2, mask)
+    # print image
+    return img